@@ -1,54 +1,188 @@
 #!/usr/bin/env python
 
 import sqlite3
+import base64
 import hashlib
+import hmac
+import os
 import secrets
+import threading
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional, Dict, Any
 import json
 
+# Number of read-only connections kept open for session/login lookups
+READ_POOL_SIZE = 4
+
+# In-process session cache: entries expire after SESSION_CACHE_TTL seconds.
+# A logout in another process (another API worker or the chat backend) only
+# clears that process's cache, so this is how long a revoked session may
+# still be accepted here; keep it short
+SESSION_CACHE_TTL = 5
+SESSION_CACHE_MAXSIZE = 10_000
+
+# scrypt cost parameters for stored login passwords
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# All auth tables and indexes, applied in one executescript call
+SCHEMA_SQL = '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        student_id TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        egov_password TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    
+    -- Databases created before student_id was UNIQUE need the index added
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_users_student_id ON users (student_id);
+    
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+'''
+
+# Hot queries live at module level so every call passes the identical SQL
+# text and hits the connection's compiled-statement cache
+STATEMENT_CACHE_SIZE = 256
+
+SQL_INSERT_USER = '''
+    INSERT INTO users (username, student_id, password_hash, egov_password)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT DO NOTHING
+    RETURNING id
+'''
+
+SQL_USER_CONFLICT = 'SELECT username = ? FROM users WHERE username = ? OR student_id = ?'
+
+SQL_GET_USER_BY_USERNAME = '''
+    SELECT id, username, student_id, password_hash, egov_password
+    FROM users WHERE username = ?
+'''
+
+SQL_UPDATE_PASSWORD_HASH = 'UPDATE users SET password_hash = ? WHERE id = ?'
+
+SQL_INSERT_SESSION = 'INSERT INTO sessions (session_id, user_id) VALUES (?, ?)'
+
+SQL_GET_USER_BY_SESSION = '''
+    SELECT u.id, u.username, u.student_id, u.egov_password
+    FROM users u
+    JOIN sessions s ON u.id = s.user_id
+    WHERE s.session_id = ?
+'''
+
+SQL_DELETE_SESSION = 'DELETE FROM sessions WHERE session_id = ?'
+
+# Checked before SCHEMA_SQL so an old database that idx_users_student_id
+# cannot be built on fails with a clear message instead of an IntegrityError
+SQL_USERS_TABLE_EXISTS = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'"
+SQL_DUPLICATE_STUDENT_IDS = 'SELECT student_id FROM users GROUP BY student_id HAVING COUNT(*) > 1'
+
+# Session IDs are SESSION_ID_BYTES random bytes, sliced from a buffer that is
+# refilled SESSION_ID_BATCH tokens at a time to batch os.urandom syscalls
+SESSION_ID_BYTES = 24
+SESSION_ID_BATCH = 64
+_rng_buf = bytearray()
+_rng_lock = threading.Lock()
+
+# Runs password hashing alongside the blocking e-governance login check
+_hash_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='auth-hash')
+
 class AuthManager:
-    def __init__(self):
+    def __init__(self, read_pool_size: int = READ_POOL_SIZE):
         self.db_path = Path(__file__).parent / 'auth.db'
+        
+        # SQLite allows a single writer but many concurrent readers in WAL
+        # mode, so keep one locked write connection plus a pool of readers
+        self._write_conn = self._connect()
+        self._write_lock = threading.Lock()
+        
         self.init_database()
+        
+        self._readers = queue.Queue()
+        for _ in range(read_pool_size):
+            conn = self._connect()
+            conn.execute('PRAGMA query_only=1')
+            self._readers.put(conn)
+        
+        # session_id -> (expires_at, user dict), shared by every request thread.
+        # Logouts bump the generation so a lookup that read the session before
+        # the delete cannot put it back into the cache afterwards
+        self._session_cache: Dict[str, Any] = {}
+        self._session_cache_lock = threading.Lock()
+        self._session_generation = 0
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a SQLite connection tuned for many small reads"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-64000')
+        return conn
+    
+    @contextmanager
+    def _reader(self):
+        """Check a read-only connection out of the pool"""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
     
     def init_database(self):
         """Initialize the SQLite database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        if self._write_conn.execute(SQL_USERS_TABLE_EXISTS).fetchone():
+            duplicates = [row[0] for row in self._write_conn.execute(SQL_DUPLICATE_STUDENT_IDS)]
+            if duplicates:
+                raise RuntimeError(
+                    f"{self.db_path} has several users registered with the same student ID "
+                    f"({', '.join(duplicates)}). Student IDs must now be unique: delete or merge "
+                    "the duplicate rows in the users table, then restart."
+                )
         
-        # Create users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                student_id TEXT NOT NULL,
-                password_hash TEXT NOT NULL,
-                egov_password TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create sessions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                session_id TEXT PRIMARY KEY,
-                user_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        self._write_conn.executescript(SCHEMA_SQL)
     
     def hash_password(self, password: str) -> str:
-        """Hash a password using SHA-256"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Hash a password with a random salt using scrypt"""
+        salt = secrets.token_bytes(16)
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+    
+    def verify_password(self, password: str, stored_hash: str) -> bool:
+        """Check a password against a stored scrypt or legacy SHA-256 hash"""
+        if stored_hash.startswith('scrypt$'):
+            _, n, r, p, salt, expected = stored_hash.split('$')
+            digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p))
+            return hmac.compare_digest(digest.hex(), expected)
+        
+        # Accounts created before scrypt was introduced store a bare SHA-256 hex digest
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored_hash)
+    
+    def needs_rehash(self, stored_hash: str) -> bool:
+        """Whether a stored hash predates the current scrypt parameters"""
+        return not stored_hash.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
     
     def generate_session_id(self) -> str:
         """Generate a secure session ID"""
-        return secrets.token_urlsafe(32)
+        with _rng_lock:
+            if len(_rng_buf) < SESSION_ID_BYTES:
+                _rng_buf.extend(os.urandom(SESSION_ID_BYTES * SESSION_ID_BATCH))
+            token = bytes(_rng_buf[:SESSION_ID_BYTES])
+            del _rng_buf[:SESSION_ID_BYTES]
+        return base64.urlsafe_b64encode(token).rstrip(b'=').decode()
     
     def verify_egov_credentials(self, student_id: str, egov_password: str) -> Dict[str, Any]:
         """Verify e-governance credentials by checking if login succeeds"""
@@ -85,6 +219,9 @@ class AuthManager:
     def register_user(self, username: str, student_id: str, password: str, egov_password: str) -> Dict[str, Any]:
         """Register a new user with e-governance credential verification"""
         try:
+            # scrypt releases the GIL, so hash while the portal login is in flight
+            hash_future = _hash_executor.submit(self.hash_password, password)
+            
             # First verify e-governance credentials
             print(f"🔐 Verifying e-governance credentials for student: {student_id}")
             
@@ -99,33 +236,24 @@ class AuthManager:
             
             print(f"✅ E-governance credentials verified successfully")
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            password_hash = hash_future.result()
             
-            # Check if username already exists
-            cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-            if cursor.fetchone():
-                conn.close()
-                return {'success': False, 'message': 'Username already exists'}
-            
-            # Check if student_id already exists
-            cursor.execute('SELECT id FROM users WHERE student_id = ?', (student_id,))
-            if cursor.fetchone():
-                conn.close()
-                return {'success': False, 'message': 'Student ID already registered'}
-            
-            # Hash the login password
-            password_hash = self.hash_password(password)
-            
-            # Insert new user
-            cursor.execute('''
-                INSERT INTO users (username, student_id, password_hash, egov_password)
-                VALUES (?, ?, ?, ?)
-            ''', (username, student_id, password_hash, egov_password))
-            
-            user_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self._write_lock:
+                cursor = self._write_conn.cursor()
+                
+                # Insert new user; UNIQUE constraints on username and student_id
+                # make this a no-op instead of a race-prone check-then-insert
+                row = cursor.execute(SQL_INSERT_USER, (username, student_id, password_hash, egov_password)).fetchone()
+                
+                if not row:
+                    self._write_conn.rollback()
+                    cursor.execute(SQL_USER_CONFLICT, (username, username, student_id))
+                    if any(taken for (taken,) in cursor.fetchall()):
+                        return {'success': False, 'message': 'Username already exists'}
+                    return {'success': False, 'message': 'Student ID already registered'}
+                
+                user_id = row[0]
+                self._write_conn.commit()
             
             return {
                 'success': True, 
@@ -140,36 +268,29 @@ class AuthManager:
     def login_user(self, username: str, password: str) -> Dict[str, Any]:
         """Login a user and create a session"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Get user by username
-            cursor.execute('''
-                SELECT id, username, student_id, password_hash, egov_password 
-                FROM users WHERE username = ?
-            ''', (username,))
+            with self._reader() as conn:
+                # Get user by username
+                user = conn.execute(SQL_GET_USER_BY_USERNAME, (username,)).fetchone()
             
-            user = cursor.fetchone()
             if not user:
-                conn.close()
                 return {'success': False, 'message': 'Invalid username or password'}
             
             user_id, username, student_id, stored_hash, egov_password = user
             
             # Verify password
-            if self.hash_password(password) != stored_hash:
-                conn.close()
+            if not self.verify_password(password, stored_hash):
                 return {'success': False, 'message': 'Invalid username or password'}
             
+            # Upgrade legacy hashes now that we know the plaintext is correct
+            new_hash = self.hash_password(password) if self.needs_rehash(stored_hash) else None
+            
             # Create session
             session_id = self.generate_session_id()
-            cursor.execute('''
-                INSERT INTO sessions (session_id, user_id)
-                VALUES (?, ?)
-            ''', (session_id, user_id))
-            
-            conn.commit()
-            conn.close()
+            with self._write_lock:
+                if new_hash:
+                    self._write_conn.execute(SQL_UPDATE_PASSWORD_HASH, (new_hash, user_id))
+                self._write_conn.execute(SQL_INSERT_SESSION, (session_id, user_id))
+                self._write_conn.commit()
             
             return {
                 'success': True,
@@ -185,29 +306,37 @@ class AuthManager:
         except Exception as e:
             return {'success': False, 'message': f'Login failed: {str(e)}'}
     
-    def get_user_by_session(self, session_id: str) -> Optional[Dict[str, Any]]:
-        """Get user details by session ID"""
+    def get_user_by_session(self, session_id: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Get user details by session ID.
+        
+        Cached lookups may be up to SESSION_CACHE_TTL seconds stale: a session
+        logged out through another process keeps resolving here until its
+        entry expires. Pass use_cache=False where that window is not acceptable.
+        """
+        with self._session_cache_lock:
+            cached = self._session_cache.get(session_id) if use_cache else None
+            if cached:
+                expires_at, user = cached
+                if expires_at > time.monotonic():
+                    return dict(user)
+                self._session_cache.pop(session_id, None)
+            generation = self._session_generation
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT u.id, u.username, u.student_id, u.egov_password
-                FROM users u
-                JOIN sessions s ON u.id = s.user_id
-                WHERE s.session_id = ?
-            ''', (session_id,))
-            
-            user = cursor.fetchone()
-            conn.close()
+            with self._reader() as conn:
+                user = conn.execute(SQL_GET_USER_BY_SESSION, (session_id,)).fetchone()
             
             if user:
-                return {
-                    'id': user[0],
-                    'username': user[1],
-                    'student_id': user[2],
-                    'egov_password': user[3]
-                }
+                user = dict(user)
+                with self._session_cache_lock:
+                    # A logout since the read may have deleted this session
+                    if generation == self._session_generation:
+                        if session_id not in self._session_cache and len(self._session_cache) >= SESSION_CACHE_MAXSIZE:
+                            # Dicts keep insertion order, so this drops the oldest entry
+                            self._session_cache.pop(next(iter(self._session_cache)))
+                        self._session_cache[session_id] = (time.monotonic() + SESSION_CACHE_TTL, user)
+                return dict(user)
             return None
             
         except Exception as e:
@@ -217,15 +346,18 @@ class AuthManager:
     def logout_user(self, session_id: str) -> bool:
         """Logout a user by removing their session"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
-            conn.commit()
-            conn.close()
+            with self._write_lock:
+                self._write_conn.execute(SQL_DELETE_SESSION, (session_id,))
+                self._write_conn.commit()
             
             return True
             
         except Exception as e:
             print(f"Error logging out user: {e}")
             return False
+
+        finally:
+            # Evict only after the delete, so no later lookup can re-cache the row
+            with self._session_cache_lock:
+                self._session_generation += 1
+                self._session_cache.pop(session_id, None)
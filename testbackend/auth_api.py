@@ -1,120 +1,153 @@
 #!/usr/bin/env python
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.concurrency import run_in_threadpool
+import msgspec
+import orjson
 import uvicorn
 import os
 from auth import AuthManager
 
 app = FastAPI(title="CHARUSAT Chatbot Auth API")
 
-# Enable CORS
+# Browser origins allowed to call the API; the Vite frontend (port 8501, see
+# vite.config.ts) and common React dev ports by default, and a comma-separated
+# CORS_ORIGINS list for deployed frontends
+CORS_ORIGINS = os.environ.get(
+    'CORS_ORIGINS', "http://localhost:8501,http://localhost:5173,http://localhost:3000"
+).split(',')
+
+# Enable CORS with explicit lists; preflights are cached by browsers for a day
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:5173", "http://localhost:3000", "*"],  # React dev server
+    allow_origins=[origin.strip() for origin in CORS_ORIGINS if origin.strip()],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,
 )
 
+# Compress larger JSON bodies for clients that send Accept-Encoding: gzip
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
+
 # Initialize auth manager
 auth_manager = AuthManager()
 
-# Pydantic models
-class RegisterRequest(BaseModel):
+# Request bodies, decoded and type-checked by msgspec instead of Pydantic
+class RegisterRequest(msgspec.Struct):
     username: str
     student_id: str
     password: str
     egov_password: str
 
-class LoginRequest(BaseModel):
+class LoginRequest(msgspec.Struct):
     username: str
     password: str
 
-class AuthResponse(BaseModel):
-    success: bool
-    message: str
-    session_id: Optional[str] = None
-    user: Optional[dict] = None
+_register_decoder = msgspec.json.Decoder(RegisterRequest)
+_login_decoder = msgspec.json.Decoder(LoginRequest)
+
+async def decode_body(request: Request, decoder: msgspec.json.Decoder):
+    """Decode the raw request body, answering 422 on malformed input"""
+    try:
+        return decoder.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def json_response(content: dict) -> Response:
+    """Serialize with orjson into a plain Response, skipping response_model
+    validation and jsonable_encoder on the way out"""
+    return Response(orjson.dumps(content), media_type="application/json")
 
-@app.post("/register", response_model=AuthResponse)
-async def register(request: RegisterRequest):
+@app.post("/register")
+async def register(request: Request):
     """Register a new user"""
-    result = auth_manager.register_user(
-        username=request.username,
-        student_id=request.student_id,
-        password=request.password,
-        egov_password=request.egov_password
+    payload = await decode_body(request, _register_decoder)
+    
+    # Verification logs in to the e-governance portal; keep it off the event loop
+    result = await run_in_threadpool(
+        auth_manager.register_user,
+        username=payload.username,
+        student_id=payload.student_id,
+        password=payload.password,
+        egov_password=payload.egov_password
     )
     
     if not result['success']:
         raise HTTPException(status_code=400, detail=result['message'])
     
-    return AuthResponse(
-        success=result['success'],
-        message=result['message']
-    )
+    return json_response({
+        "success": result['success'],
+        "message": result['message'],
+        "session_id": None,
+        "user": None
+    })
 
-@app.post("/login", response_model=AuthResponse)
-async def login(request: LoginRequest):
+@app.post("/login")
+async def login(request: Request):
     """Login a user"""
-    result = auth_manager.login_user(
-        username=request.username,
-        password=request.password
+    payload = await decode_body(request, _login_decoder)
+    
+    result = await run_in_threadpool(
+        auth_manager.login_user,
+        username=payload.username,
+        password=payload.password
     )
     
     if not result['success']:
         raise HTTPException(status_code=401, detail=result['message'])
     
-    return AuthResponse(
-        success=result['success'],
-        message=result['message'],
-        session_id=result['session_id'],
-        user=result['user']
-    )
+    return json_response({
+        "success": result['success'],
+        "message": result['message'],
+        "session_id": result['session_id'],
+        "user": result['user']
+    })
 
+# /me and /logout query SQLite, so they stay plain def and FastAPI runs them in
+# its threadpool instead of on the event loop
 @app.get("/me")
-async def get_current_user(request: Request):
+def get_current_user(request: Request):
     """Get current user by session ID"""
     session_id = request.headers.get("Authorization")
     if not session_id:
         raise HTTPException(status_code=401, detail="No session provided")
     
     # Remove "Bearer " prefix if present
-    if session_id.startswith("Bearer "):
-        session_id = session_id[7:]
+    session_id = session_id.removeprefix("Bearer ")
     
     user = auth_manager.get_user_by_session(session_id)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid session")
     
-    return {"success": True, "user": user}
+    return json_response({"success": True, "user": user})
 
 @app.post("/logout")
-async def logout(request: Request):
+def logout(request: Request):
     """Logout a user"""
     session_id = request.headers.get("Authorization")
     if not session_id:
         raise HTTPException(status_code=401, detail="No session provided")
     
     # Remove "Bearer " prefix if present
-    if session_id.startswith("Bearer "):
-        session_id = session_id[7:]
+    session_id = session_id.removeprefix("Bearer ")
     
     success = auth_manager.logout_user(session_id)
     if not success:
         raise HTTPException(status_code=400, detail="Logout failed")
     
-    return {"success": True, "message": "Logged out successfully"}
+    return json_response({"success": True, "message": "Logged out successfully"})
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "auth"}
+    return json_response({"status": "healthy", "service": "auth"})
 
 if __name__ == "__main__":
     port = int(os.environ.get('AUTH_PORT', 8093))
     print(f"🚀 Starting Auth API on port {port}")
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # "auto" picks uvloop and httptools when installed and falls back to
+    # asyncio and h11 elsewhere (uvloop has no Windows build)
+    uvicorn.run(app, host="0.0.0.0", port=port, loop="auto", http="auto", access_log=False)
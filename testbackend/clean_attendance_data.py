@@ -3,65 +3,77 @@
 Clean and format the extracted attendance data
 """
 
-import json
+import argparse
+import gzip
+import orjson
 import re
 
-def clean_attendance_data():
+# Patterns used while parsing every attendance record, compiled once
+_PRESENT_TOTAL_RE = re.compile(r'(\d+)\s*/\s*(\d+)')
+_PCT_RE = re.compile(r'(\d+(?:\.\d+)?)%')
+_WS_RE = re.compile(r'\s+')
+
+def clean_attendance_data(pretty: bool = False):
     """Clean and format the attendance data"""
     
-    with open('extracted_attendance_data.json', 'r', encoding='utf-8') as f:
-        raw_data = json.load(f)
+    with open('extracted_attendance_data.json', 'rb') as f:
+        raw_data = orjson.loads(f.read())
     
     print("🧹 Cleaning attendance data...")
     
     cleaned_data = []
+    course_names = {}
     
     for record in raw_data:
+        # Collect course name mappings in the same pass
+        code = record.get('Course Code')
+        name = record.get('Course Name')
+        if code is not None and name is not None:
+            course_names[code.strip()] = name.strip()
+        
         # Look for records with Course, Class Type, and Percentage
-        if all(key in record for key in ['Course', 'Class Type', 'Percentage']):
-            
-            # Clean the course name
-            course = record['Course'].strip()
-            class_type = record['Class Type'].strip()
-            percentage = record['Percentage'].strip()
-            
-            # Clean the Present/Total field
-            present_total = record.get('Present / Total', record.get('Present/Total', '')).strip()
-            present_total = re.sub(r'\s+', ' ', present_total)  # Remove extra whitespace
-            present_total = present_total.replace('/\n', '/').replace('\n/', '/')
-            
-            # Extract present and total numbers
-            present_match = re.search(r'(\d+)\s*/\s*(\d+)', present_total)
-            if present_match:
-                present = int(present_match.group(1))
-                total = int(present_match.group(2))
-            else:
-                present = None
-                total = None
-            
-            # Extract percentage number
-            percentage_match = re.search(r'(\d+(?:\.\d+)?)%', percentage)
-            percentage_num = float(percentage_match.group(1)) if percentage_match else None
-            
-            cleaned_record = {
-                'course_code': course,
-                'class_type': class_type,
-                'present': present,
-                'total': total,
-                'percentage': percentage_num,
-                'raw_present_total': present_total,
-                'raw_percentage': percentage
-            }
-            
-            cleaned_data.append(cleaned_record)
-    
-    # Also add course name mappings from the data
-    course_names = {}
-    for record in raw_data:
-        if 'Course Code' in record and 'Course Name' in record:
-            code = record['Course Code'].strip()
-            name = record['Course Name'].strip()
-            course_names[code] = name
+        course = record.get('Course')
+        class_type = record.get('Class Type')
+        percentage = record.get('Percentage')
+        if course is None or class_type is None or percentage is None:
+            continue
+        
+        # Clean the course name
+        course = course.strip()
+        class_type = class_type.strip()
+        percentage = percentage.strip()
+        
+        # Clean the Present/Total field
+        present_total = record.get('Present / Total')
+        if present_total is None:
+            present_total = record.get('Present/Total', '')
+        present_total = present_total.strip()
+        present_total = _WS_RE.sub(' ', present_total)  # Remove extra whitespace
+        
+        # Extract present and total numbers
+        present_match = _PRESENT_TOTAL_RE.search(present_total)
+        if present_match:
+            present = int(present_match.group(1))
+            total = int(present_match.group(2))
+        else:
+            present = None
+            total = None
+        
+        # Extract percentage number
+        percentage_match = _PCT_RE.search(percentage)
+        percentage_num = float(percentage_match.group(1)) if percentage_match else None
+        
+        cleaned_record = {
+            'course_code': course,
+            'class_type': class_type,
+            'present': present,
+            'total': total,
+            'percentage': percentage_num,
+            'raw_present_total': present_total,
+            'raw_percentage': percentage
+        }
+        
+        cleaned_data.append(cleaned_record)
     
     # Add course names to cleaned data
     for record in cleaned_data:
@@ -69,12 +81,18 @@ def clean_attendance_data():
         if course_code in course_names:
             record['course_name'] = course_names[course_code]
     
-    # Save cleaned data
-    with open('attendance_data_clean.json', 'w', encoding='utf-8') as f:
-        json.dump(cleaned_data, f, indent=2, ensure_ascii=False)
+    # Save cleaned data; compact + gzip unless a human wants to read it
+    if pretty:
+        output_file = 'attendance_data_clean.json'
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(cleaned_data, option=orjson.OPT_INDENT_2))
+    else:
+        output_file = 'attendance_data_clean.json.gz'
+        with gzip.open(output_file, 'wb', compresslevel=1) as f:
+            f.write(orjson.dumps(cleaned_data))
     
     print(f"✅ Cleaned {len(cleaned_data)} attendance records")
-    print("💾 Clean data saved to 'attendance_data_clean.json'")
+    print(f"💾 Clean data saved to '{output_file}'")
     
     # Display summary
     print("\n📊 Attendance Summary:")
@@ -102,4 +120,7 @@ def clean_attendance_data():
     return cleaned_data
 
 if __name__ == "__main__":
-    clean_attendance_data()
+    parser = argparse.ArgumentParser(description="Clean extracted attendance data")
+    parser.add_argument("--pretty", action="store_true", help="Save indented, uncompressed JSON")
+    args = parser.parse_args()
+    clean_attendance_data(pretty=args.pretty)
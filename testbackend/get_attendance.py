@@ -4,208 +4,651 @@ CHARUSAT Attendance API
 A simple function that takes student ID and password and returns cleaned attendance data.
 """
 
-import requests
-from bs4 import BeautifulSoup
-import urllib3
-import json
+import asyncio
+import httpx
+import lxml.html
+import msgspec
 import re
-from typing import Dict, List, Optional, Tuple
+import copy
+import gzip
+import hashlib
+import os
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from html import unescape
+from typing import Dict, Iterable, List, Optional, Tuple
 
-# Disable SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# Patterns used while parsing every attendance record, compiled once
+_PRESENT_TOTAL_RE = re.compile(r'(\d+)\s*/\s*(\d+)')
+_PCT_RE = re.compile(r'(\d+(?:\.\d+)?)%')
+_WS_RE = re.compile(r'\s+')
+_GROSS_PCT_RE = re.compile(r'(\d+(?:\.\d+)?)\s*%')
+_NUMBER_RE = re.compile(r'(\d+(?:\.\d+)?)')
 
+# ASP.NET state inputs and their value attribute, read straight from the markup;
+# double, single or no quotes, and never the tail of a data-name/data-value
+_STATE_INPUT_RE = re.compile(
+    r'<input\b[^>]*?(?<![\w-])name\s*=\s*(["\']?)(__VIEWSTATE|__VIEWSTATEGENERATOR|__EVENTVALIDATION)\1(?=[\s/>])[^>]*>',
+    re.IGNORECASE
+)
+_VALUE_ATTR_RE = re.compile(
+    r'(?<![\w-])value\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))',
+    re.IGNORECASE
+)
 
-def get_student_attendance(student_id: str, password: str) -> Dict:
+# Failed TCP/TLS connects to the portal are retried this many times before giving up
+PORTAL_CONNECT_RETRIES = 2
+
+# The idempotent login page GET is also retried on transient gateway/overload
+# statuses, backing off RETRY_BACKOFF * 2**attempt seconds; postbacks never are
+RETRY_STATUS_CODES = frozenset((429, 502, 503, 504))
+PORTAL_STATUS_RETRIES = 2
+RETRY_BACKOFF = 0.2
+
+# Shared HTTP/2 connection pool so repeated logins reuse warm TLS connections
+# to the portal. Cookies still live on each Client, so students never share state.
+_HTTP_TRANSPORT = httpx.HTTPTransport(
+    http2=True,
+    verify=False,
+    limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+    retries=PORTAL_CONNECT_RETRIES,
+)
+
+# The async pool, one per event loop since its connections belong to the loop
+# that opened them; entries go away with their loop
+_ASYNC_HTTP_TRANSPORTS: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport]' = weakref.WeakKeyDictionary()
+
+LOGIN_URL = "https://charusat.edu.in:912/eGovernance/"
+APP_SELECTION_URL = "https://charusat.edu.in:912/eGovernance/frmAppSelection.aspx"
+
+# Hidden ASP.NET state fields every postback must echo back
+FORM_STATE_FIELDS = ("__VIEWSTATE", "__VIEWSTATEGENERATOR", "__EVENTVALIDATION")
+
+# Attendance changes a few times a day at most, so successful results are
+# reused for ATTENDANCE_CACHE_TTL seconds per (student, password)
+ATTENDANCE_CACHE_TTL = 900
+ATTENDANCE_CACHE_MAXSIZE = 1024
+_attendance_cache: Dict[Tuple[str, str], Tuple[float, Dict]] = {}
+_attendance_cache_lock = threading.Lock()
+
+# Concurrent scrapes of the same account wait on one lock (and refcount) here,
+# so only the first logs in and the rest pick up its cached result
+_scrape_locks: Dict[Tuple[str, str], List] = {}
+
+# The same for async callers, keyed by event loop too since an asyncio.Lock
+# belongs to the loop it is first used on
+_async_scrape_locks: Dict[Tuple[asyncio.AbstractEventLoop, Tuple[str, str]], List] = {}
+
+# The login page's ASP.NET state is the same for every visitor, so its hidden
+# fields are reused for a few minutes instead of fetching the page per login
+LOGIN_FORM_CACHE_TTL = 300
+_login_form_cache: Dict[str, Tuple[float, Dict[str, str]]] = {}
+
+# ASP.NET error page phrases meaning posted __VIEWSTATE/__EVENTVALIDATION are
+# stale; a login page carrying one is never taken as a credential rejection
+STALE_FORM_STATE_ERRORS = (
+    'validation of viewstate mac failed',
+    'invalid viewstate',
+    'the state information is invalid for this page',
+    'invalid postback or callback argument',
+)
+
+# Last page parsed on each thread, so the dashboard and gross attendance checks
+# on one response share a single DOM build
+_parsed_page = threading.local()
+
+# Upper bound on concurrent portal logins when refreshing many students at once
+ATTENDANCE_BATCH_CONCURRENCY = int(os.environ.get('ATTENDANCE_BATCH_CONCURRENCY', 8))
+
+# A table whose first row mentions any of these is treated as attendance data
+ATTENDANCE_HEADER_WORDS = ('course', 'subject', 'attendance', 'present', 'percentage')
+
+# Column headers the portal spells more than one way, mapped to one name
+HEADER_ALIASES = {'Present/Total': 'Present / Total'}
+
+# The two grids clean_attendance_data needs; later tables are page layout
+ATTENDANCE_GRID_COLUMNS = frozenset(('Course', 'Class Type', 'Percentage'))
+COURSE_NAME_GRID_COLUMNS = frozenset(('Course Code', 'Course Name'))
+
+
+
+class AttendanceRecord(msgspec.Struct, omit_defaults=True):
+    """One cleaned attendance row; encodes to the same JSON object as before"""
+    course_code: str
+    class_type: str
+    present: Optional[int]
+    total: Optional[int]
+    percentage: Optional[float]
+    raw_present_total: str
+    raw_percentage: str
+    course_name: Optional[str] = None
+
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'br, gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+
+def get_student_attendance(student_id: str, password: str, force_refresh: bool = False) -> Dict:
     """
     Get cleaned attendance data for a student.
     
     Args:
         student_id (str): Student ID (e.g., "23CS012")
         password (str): Student password
+        force_refresh (bool): Skip the result cache and scrape the portal again
         
     Returns:
         Dict: Dictionary containing:
             - success (bool): Whether the operation was successful
-            - data (List): List of attendance records if successful
+            - data (List[Dict]): Attendance records if successful
             - message (str): Status message
             - summary (Dict): Summary statistics if successful
     """
     
-    # Validate inputs
-    if not student_id or not password:
-        raise ValueError("Student ID and password must be provided")
+    validate_credentials(student_id, password)
     
-    if not isinstance(student_id, str) or not isinstance(password, str):
-        raise ValueError("Student ID and password must be strings")
+    if not force_refresh:
+        cached = get_cached_attendance(student_id, password)
+        if cached:
+            return cached
+    
+    with _single_scrape(student_id, password):
+        # An identical call may have finished its scrape while this one waited
+        if not force_refresh:
+            cached = get_cached_attendance(student_id, password)
+            if cached:
+                return cached
+        
+        result = _scrape_student_attendance(student_id, password)
+        cache_attendance(student_id, password, result)
+    return result
+
+
+async def get_student_attendance_async(student_id: str, password: str, force_refresh: bool = False) -> Dict:
+    """
+    Async version of get_student_attendance for callers running on an event loop.
+    
+    Uses one httpx.AsyncClient per student so the login, dashboard and
+    postback requests share a connection without blocking the loop.
+    """
+    
+    validate_credentials(student_id, password)
     
+    if not force_refresh:
+        cached = get_cached_attendance(student_id, password)
+        if cached:
+            return cached
+    
+    async with _single_scrape_async(student_id, password):
+        # An identical call may have finished its scrape while this one waited
+        if not force_refresh:
+            cached = get_cached_attendance(student_id, password)
+            if cached:
+                return cached
+        
+        result = await _scrape_student_attendance_async(student_id, password)
+        cache_attendance(student_id, password, result)
+    return result
+
+
+async def get_students_attendance_async(credentials: Iterable[Tuple[str, str]], force_refresh: bool = False) -> List[Dict]:
+    """
+    Fetch attendance for many students concurrently.
+    
+    Args:
+        credentials: (student_id, password) pairs
+        force_refresh (bool): Skip the result cache for every student
+        
+    Returns:
+        List[Dict]: One result per pair, in input order. A student whose
+        request raised gets a failure result instead of failing the batch.
+    """
+    
+    credentials = list(credentials)
+    semaphore = asyncio.Semaphore(ATTENDANCE_BATCH_CONCURRENCY)
+    
+    async def fetch_one(student_id: str, password: str) -> Dict:
+        async with semaphore:
+            return await get_student_attendance_async(student_id, password, force_refresh)
+    
+    results = await asyncio.gather(
+        *(fetch_one(student_id, password) for student_id, password in credentials),
+        return_exceptions=True
+    )
+    
+    return [
+        failure_result(f"Error retrieving attendance for student {student_id}: {result}")
+        if isinstance(result, Exception) else result
+        for (student_id, _), result in zip(credentials, results)
+    ]
+
+
+def _scrape_student_attendance(student_id: str, password: str) -> Dict:
+    """Run the login, dashboard and attendance postback flow synchronously"""
     try:
         # Step 1: Create session and login
         session = create_session()
         dashboard_html = login_to_portal(session, student_id, password)
         
         if not dashboard_html:
-            return {
-                "success": False,
-                "data": [],
-                "message": f"Failed to login for student {student_id}. Please check your credentials.",
-                "summary": {}
-            }
+            return failure_result(f"Failed to login for student {student_id}. Please check your credentials.")
         
         # Step 2: Check for gross attendance on dashboard first
-        dashboard_soup = BeautifulSoup(dashboard_html, "html.parser")
-        gross_attendance_element = dashboard_soup.find(id="lblPopGrossAtt")
-        
-        if gross_attendance_element:
-            gross_text = gross_attendance_element.get_text().strip()
-            
-            # Extract gross attendance
-            gross_attendance = None
-            gross_match = re.search(r'(\d+(?:\.\d+)?)\s*%', gross_text)
-            if not gross_match:
-                gross_match = re.search(r'(\d+(?:\.\d+)?)', gross_text)
-            
-            if gross_match:
-                gross_attendance = float(gross_match.group(1))
-                
-                # Return concise response with gross attendance
-                return {
-                    "success": True,
-                    "message": f"Attendance for student {student_id} retrieved: Overall {gross_attendance}%",
-                    "data": [],
-                    "summary": {
-                        "gross_attendance": gross_attendance, 
-                        "overall_percentage": gross_attendance,
-                        "student_id": student_id
-                    }
-                }
+        result = gross_attendance_result(student_id, dashboard_html)
+        if result:
+            return result
         
         # Step 3: Get detailed attendance data if needed
         attendance_html = get_attendance_page(session, dashboard_html)
         
         if not attendance_html:
-            return {
-                "success": False,
-                "data": [],
-                "message": f"Failed to access detailed attendance page for student {student_id}",
-                "summary": {}
-            }
-        
-        # Step 4: Extract and clean data
-        raw_data, gross_attendance_from_detail = extract_attendance_tables(attendance_html)
-        cleaned_data = clean_attendance_data(raw_data)
-        
-        # Use gross attendance from dashboard if available, otherwise from detail page
-        final_gross_attendance = gross_attendance if 'gross_attendance' in locals() else gross_attendance_from_detail
-        
-        if not cleaned_data and final_gross_attendance is None:
-            return {
-                "success": False,
-                "data": [],
-                "message": f"No attendance data found for student {student_id}",
-                "summary": {}
-            }
-        
-        # Step 5: Generate summary
-        summary = generate_summary(cleaned_data, final_gross_attendance)
-        summary["student_id"] = student_id
-        
-        return {
-            "success": True,
-            "data": cleaned_data,
-            "message": f"Attendance for student {student_id} retrieved: Overall {summary.get('overall_percentage', 0)}% ({len(cleaned_data)} records)",
-            "summary": summary
-        }
+            return failure_result(f"Failed to access detailed attendance page for student {student_id}")
+        
+        # Step 4 & 5: Extract, clean and summarize
+        return detailed_attendance_result(student_id, attendance_html)
         
     except Exception as e:
-        return {
-            "success": False,
-            "data": [],
-            "message": f"Error retrieving attendance for student {student_id}: {str(e)}",
-            "summary": {}
-        }
+        return failure_result(f"Error retrieving attendance for student {student_id}: {str(e)}")
 
 
-def create_session() -> requests.Session:
-    """Create a session with proper headers"""
-    session = requests.Session()
-    session.verify = False
+async def _scrape_student_attendance_async(student_id: str, password: str) -> Dict:
+    """Run the same flow as _scrape_student_attendance over an httpx.AsyncClient"""
+    try:
+        client = create_async_client()
+        dashboard_html = await login_to_portal_async(client, student_id, password)
+        
+        if not dashboard_html:
+            return failure_result(f"Failed to login for student {student_id}. Please check your credentials.")
+        
+        result = gross_attendance_result(student_id, dashboard_html)
+        if result:
+            return result
+        
+        attendance_html = await get_attendance_page_async(client, dashboard_html)
+        
+        if not attendance_html:
+            return failure_result(f"Failed to access detailed attendance page for student {student_id}")
+        
+        return detailed_attendance_result(student_id, attendance_html)
+        
+    except Exception as e:
+        return failure_result(f"Error retrieving attendance for student {student_id}: {str(e)}")
+
+
+def validate_credentials(student_id: str, password: str) -> None:
+    """Raise ValueError if the student ID or password is missing or not a string"""
+    if not student_id or not password:
+        raise ValueError("Student ID and password must be provided")
     
-    session.headers.update({
-        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate',
-        'Connection': 'keep-alive',
-    })
+    if not isinstance(student_id, str) or not isinstance(password, str):
+        raise ValueError("Student ID and password must be strings")
+
+
+def _attendance_cache_key(student_id: str, password: str) -> Tuple[str, str]:
+    """Key results by password hash too, so a wrong password never hits the cache"""
+    return student_id, hashlib.sha256(password.encode()).hexdigest()
+
+
+@contextmanager
+def _single_scrape(student_id: str, password: str):
+    """Let only one thread at a time scrape a given account"""
+    key = _attendance_cache_key(student_id, password)
+    with _attendance_cache_lock:
+        entry = _scrape_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _attendance_cache_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _scrape_locks[key]
+
+
+@asynccontextmanager
+async def _single_scrape_async(student_id: str, password: str):
+    """Let only one task per event loop at a time scrape a given account"""
+    key = (asyncio.get_running_loop(), _attendance_cache_key(student_id, password))
+    with _attendance_cache_lock:
+        entry = _async_scrape_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        with _attendance_cache_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _async_scrape_locks[key]
+
+
+def get_cached_attendance(student_id: str, password: str) -> Optional[Dict]:
+    """Return a copy of a fresh cached result, or None"""
+    key = _attendance_cache_key(student_id, password)
+    with _attendance_cache_lock:
+        entry = _attendance_cache.get(key)
+        if not entry:
+            return None
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del _attendance_cache[key]
+            return None
+    return copy.deepcopy(result)
+
+
+def cache_attendance(student_id: str, password: str, result: Dict) -> None:
+    """Remember a successful result for ATTENDANCE_CACHE_TTL seconds"""
+    if not result.get("success"):
+        return
     
-    return session
+    key = _attendance_cache_key(student_id, password)
+    with _attendance_cache_lock:
+        if key not in _attendance_cache and len(_attendance_cache) >= ATTENDANCE_CACHE_MAXSIZE:
+            # Dicts keep insertion order, so this drops the oldest entry
+            _attendance_cache.pop(next(iter(_attendance_cache)))
+        _attendance_cache[key] = (time.monotonic() + ATTENDANCE_CACHE_TTL, copy.deepcopy(result))
 
 
-def login_to_portal(session: requests.Session, student_id: str, password: str) -> Optional[str]:
-    """Login to the CHARUSAT portal and return dashboard HTML"""
+def get_cached_login_form() -> Optional[Dict[str, str]]:
+    """Return the login page's hidden fields if fetched recently, or None"""
+    entry = _login_form_cache.get(LOGIN_URL)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+
+def cache_login_form(login_html: str) -> Dict[str, str]:
+    """Remember the login page's hidden fields for LOGIN_FORM_CACHE_TTL seconds"""
+    fields = hidden_form_fields(login_html)
+    _login_form_cache[LOGIN_URL] = (time.monotonic() + LOGIN_FORM_CACHE_TTL, fields)
+    return fields
+
+
+def is_stale_form_state(html: str) -> bool:
+    """Whether a postback was rejected for stale ASP.NET view state or event validation"""
+    html = html.lower()
+    return any(error in html for error in STALE_FORM_STATE_ERRORS)
+
+
+def looks_logged_in(html: str) -> bool:
+    """Whether a login response is the dashboard or the application list"""
+    return is_dashboard(html) or 'dlAppList' in html
+
+
+def is_credential_rejection(html: str) -> bool:
+    """Whether the portal answered a login by showing the login form again"""
+    return 'txtPassword' in html and not is_stale_form_state(html)
+
+
+def cached_form_login_settled(response: httpx.Response) -> bool:
+    """
+    Whether a login posted with the cached form got a definite answer.
+    
+    Only the dashboard, the application list or a plain credential rejection
+    count; a non-200 (ASP.NET's generic "Runtime Error" page included) or any
+    other page means the cached state may be at fault and the form is refetched.
+    """
+    if response.status_code != 200:
+        return False
+    return looks_logged_in(response.text) or is_credential_rejection(response.text)
+
+
+def failure_result(message: str) -> Dict:
+    """Build the standard unsuccessful response"""
+    return {
+        "success": False,
+        "data": [],
+        "message": message,
+        "summary": {}
+    }
+
+
+def parse_gross_attendance(gross_text: str) -> Optional[float]:
+    """Extract the gross attendance percentage from the lblPopGrossAtt text"""
+    # Pattern 1: Look for percentage with % sign
+    gross_match = _GROSS_PCT_RE.search(gross_text)
+    if not gross_match:
+        # Pattern 2: Look for standalone number (might be without %)
+        gross_match = _NUMBER_RE.search(gross_text)
+    
+    return float(gross_match.group(1)) if gross_match else None
+
+
+def gross_attendance_result(student_id: str, dashboard_html: str) -> Optional[Dict]:
+    """Return a concise response if the dashboard already shows gross attendance"""
+    # Most dashboards without the label never need a DOM; a substring test settles it
+    if 'lblPopGrossAtt' not in dashboard_html:
+        return None
     
-    # Get login page
-    print("📄 Accessing login page...")
-    login_response = session.get("https://charusat.edu.in:912/eGovernance/")
+    gross_elements = parse_page(dashboard_html).xpath('//*[@id="lblPopGrossAtt"]')
     
-    if login_response.status_code != 200:
-        print(f"❌ Failed to get login page: {login_response.status_code}")
+    if not gross_elements:
         return None
     
-    # Parse login form
-    soup = BeautifulSoup(login_response.text, "html.parser")
-    viewstate = soup.find("input", {"name": "__VIEWSTATE"})
-    viewstate_gen = soup.find("input", {"name": "__VIEWSTATEGENERATOR"})
-    event_validation = soup.find("input", {"name": "__EVENTVALIDATION"})
+    gross_attendance = parse_gross_attendance(gross_elements[0].text_content().strip())
+    if gross_attendance is None:
+        return None
     
-    # Login
-    print("🔐 Logging in...")
-    login_payload = {
+    return {
+        "success": True,
+        "message": f"Attendance for student {student_id} retrieved: Overall {gross_attendance}%",
+        "data": [],
+        "summary": {
+            "gross_attendance": gross_attendance, 
+            "overall_percentage": gross_attendance,
+            "student_id": student_id
+        }
+    }
+
+
+def detailed_attendance_result(student_id: str, attendance_html: str) -> Dict:
+    """Extract, clean and summarize the detailed attendance page"""
+    raw_data, gross_attendance = extract_attendance_tables(attendance_html)
+    cleaned_data = clean_attendance_data(raw_data)
+    
+    if not cleaned_data and gross_attendance is None:
+        return failure_result(f"No attendance data found for student {student_id}")
+    
+    summary = generate_summary(cleaned_data, gross_attendance)
+    summary["student_id"] = student_id
+    
+    return {
+        "success": True,
+        # Structs stay internal; callers get plain JSON-ready dicts as before
+        "data": msgspec.to_builtins(cleaned_data),
+        "message": f"Attendance for student {student_id} retrieved: Overall {summary.get('overall_percentage', 0)}% ({len(cleaned_data)} records)",
+        "summary": summary
+    }
+
+
+def parse_page(html: str) -> lxml.html.HtmlElement:
+    """Parse a portal page, reusing the tree if this thread just parsed the same string"""
+    if getattr(_parsed_page, 'html', None) is html:
+        return _parsed_page.tree
+    tree = lxml.html.fromstring(html)
+    _parsed_page.html, _parsed_page.tree = html, tree
+    return tree
+
+
+def hidden_form_fields(html: str) -> Dict[str, str]:
+    """Collect the ASP.NET state fields with a regex scan instead of a DOM build"""
+    fields = dict.fromkeys(FORM_STATE_FIELDS, "")
+    seen = set()
+    for match in _STATE_INPUT_RE.finditer(html):
+        name = match.group(2)
+        if name in seen:
+            continue
+        seen.add(name)
+        value = _VALUE_ATTR_RE.search(match.group(0))
+        if value:
+            fields[name] = unescape(next(group for group in value.groups() if group is not None))
+    
+    # Markup the scan cannot read (a '>' inside another attribute, say) gets the full parse
+    if not all(fields.values()):
+        page = parse_page(html)
+        for name in FORM_STATE_FIELDS:
+            if not fields[name]:
+                values = page.xpath('//input[@name=$name]/@value', name=name)
+                if values:
+                    fields[name] = values[0]
+    return fields
+
+
+def login_payload(form_fields: Dict[str, str], student_id: str, password: str) -> Dict[str, str]:
+    """Build the login form submission from the login page's hidden fields"""
+    return {
         "txtUserName": student_id,
         "txtPassword": password,
-        "__VIEWSTATE": viewstate['value'] if viewstate else "",
-        "__VIEWSTATEGENERATOR": viewstate_gen['value'] if viewstate_gen else "",
-        "__EVENTVALIDATION": event_validation['value'] if event_validation else "",
+        **form_fields,
         "__EVENTTARGET": "btnLogin",
         "__EVENTARGUMENT": "",
     }
+
+
+def is_dashboard(html: str) -> bool:
+    """Whether the page is the dashboard, judged by its gross attendance panel"""
+    # Only parse when the id appears at all; pages without it skip the DOM build
+    if 'pnlGrossAtt' not in html:
+        return False
+    return bool(parse_page(html).xpath('//div[@id="pnlGrossAtt"]'))
+
+
+def egovernance_payload(login_html: str) -> Optional[Dict[str, str]]:
+    """Build the postback that opens e-Governance, or None if the link is missing"""
+    if not parse_page(login_html).xpath('//a[contains(@href, "dlAppList")]'):
+        return None
+    
+    return {
+        **hidden_form_fields(login_html),
+        "__EVENTTARGET": "dlAppList$ctl00$ImageButton1",
+        "__EVENTARGUMENT": "",
+    }
+
+
+def attendance_postback_payload(dashboard_html: str) -> Dict[str, str]:
+    """Build the postback that opens the detailed attendance grid"""
+    return {
+        **hidden_form_fields(dashboard_html),
+        "__EVENTTARGET": "grdGrossAtt$ctl01$lnkRequestViewTT",
+        "__EVENTARGUMENT": "",
+    }
+
+
+def create_session() -> httpx.Client:
+    """
+    Create a client with proper headers on top of the shared connection pool.
+    
+    Closing the client would close the shared transport, so callers just drop it.
+    """
+    return httpx.Client(
+        transport=_HTTP_TRANSPORT,
+        headers=DEFAULT_HEADERS,
+        follow_redirects=True,
+        timeout=30,
+    )
+
+
+def create_async_client() -> httpx.AsyncClient:
+    """
+    Create an async client with the same headers as create_session, on the
+    running loop's shared connection pool; like create_session, callers just drop it.
+    """
+    loop = asyncio.get_running_loop()
+    transport = _ASYNC_HTTP_TRANSPORTS.get(loop)
+    if transport is None:
+        transport = _ASYNC_HTTP_TRANSPORTS[loop] = httpx.AsyncHTTPTransport(
+            http2=True,
+            verify=False,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+            retries=PORTAL_CONNECT_RETRIES,
+        )
+    return httpx.AsyncClient(
+        transport=transport,
+        headers=DEFAULT_HEADERS,
+        follow_redirects=True,
+        timeout=30,
+    )
+
+
+def get_login_page(session: httpx.Client) -> httpx.Response:
+    """GET the login page, retrying transient portal errors with backoff"""
+    for attempt in range(PORTAL_STATUS_RETRIES):
+        response = session.get(LOGIN_URL)
+        if response.status_code not in RETRY_STATUS_CODES:
+            return response
+        print(f"⏳ Login page returned {response.status_code}, retrying...")
+        time.sleep(RETRY_BACKOFF * 2 ** attempt)
+    return session.get(LOGIN_URL)
+
+
+async def get_login_page_async(client: httpx.AsyncClient) -> httpx.Response:
+    """Async version of get_login_page"""
+    for attempt in range(PORTAL_STATUS_RETRIES):
+        response = await client.get(LOGIN_URL)
+        if response.status_code not in RETRY_STATUS_CODES:
+            return response
+        print(f"⏳ Login page returned {response.status_code}, retrying...")
+        await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+    return await client.get(LOGIN_URL)
+
+
+def login_to_portal(session: httpx.Client, student_id: str, password: str) -> Optional[str]:
+    """Login to the CHARUSAT portal and return dashboard HTML"""
     
-    login_result = session.post("https://charusat.edu.in:912/eGovernance/", data=login_payload)
+    # Try the cached login form state first; unless the portal answers with the
+    # dashboard or a plain credential rejection, drop the cached state and fall
+    # through to the normal fetch-and-post flow. A wrong password still costs a
+    # single post
+    login_result = None
+    form_fields = get_cached_login_form()
+    if form_fields:
+        print("🔐 Logging in with cached login form...")
+        login_result = session.post(LOGIN_URL, data=login_payload(form_fields, student_id, password))
+        if not cached_form_login_settled(login_result):
+            print("♻️  Cached login form was not accepted, refetching...")
+            _login_form_cache.pop(LOGIN_URL, None)
+            login_result = None
+    
+    if login_result is None:
+        # Get login page
+        print("📄 Accessing login page...")
+        login_response = get_login_page(session)
+        
+        if login_response.status_code != 200:
+            print(f"❌ Failed to get login page: {login_response.status_code}")
+            return None
+        
+        # Login
+        print("🔐 Logging in...")
+        form_fields = cache_login_form(login_response.text)
+        login_result = session.post(LOGIN_URL, data=login_payload(form_fields, student_id, password))
     
     if login_result.status_code != 200:
         print(f"❌ Login failed: {login_result.status_code}")
         return None
     
     # Check if we need to navigate to e-governance
-    login_soup = BeautifulSoup(login_result.text, "html.parser")
-    dashboard_div = login_soup.find("div", {"id": "pnlGrossAtt"})
-    
-    if dashboard_div:
+    if is_dashboard(login_result.text):
         print("✅ Already on dashboard")
         return login_result.text
     else:
         # Navigate to e-governance
         print("🎯 Navigating to e-Governance...")
-        egovernance_link = login_soup.find("a", href=lambda x: x and "dlAppList" in x)
+        egovernance_data = egovernance_payload(login_result.text)
         
-        if not egovernance_link:
+        if not egovernance_data:
             print("❌ No e-governance link found")
             return None
         
-        # Get fresh form data
-        viewstate = login_soup.find("input", {"name": "__VIEWSTATE"})
-        viewstate_gen = login_soup.find("input", {"name": "__VIEWSTATEGENERATOR"})
-        event_validation = login_soup.find("input", {"name": "__EVENTVALIDATION"})
-        
-        egovernance_payload = {
-            "__VIEWSTATE": viewstate['value'] if viewstate else "",
-            "__VIEWSTATEGENERATOR": viewstate_gen['value'] if viewstate_gen else "",
-            "__EVENTVALIDATION": event_validation['value'] if event_validation else "",
-            "__EVENTTARGET": "dlAppList$ctl00$ImageButton1",
-            "__EVENTARGUMENT": "",
-        }
-        
-        dashboard_response = session.post(login_result.url, data=egovernance_payload)
+        dashboard_response = session.post(login_result.url, data=egovernance_data)
         
         if dashboard_response.status_code == 200:
             print("✅ Dashboard loaded")
@@ -215,29 +658,64 @@ def login_to_portal(session: requests.Session, student_id: str, password: str) -
             return None
 
 
-def get_attendance_page(session: requests.Session, dashboard_html: str) -> Optional[str]:
+async def login_to_portal_async(client: httpx.AsyncClient, student_id: str, password: str) -> Optional[str]:
+    """Async version of login_to_portal using an httpx.AsyncClient"""
+    
+    login_result = None
+    form_fields = get_cached_login_form()
+    if form_fields:
+        print("🔐 Logging in with cached login form...")
+        login_result = await client.post(LOGIN_URL, data=login_payload(form_fields, student_id, password))
+        if not cached_form_login_settled(login_result):
+            print("♻️  Cached login form was not accepted, refetching...")
+            _login_form_cache.pop(LOGIN_URL, None)
+            login_result = None
+    
+    if login_result is None:
+        print("📄 Accessing login page...")
+        login_response = await get_login_page_async(client)
+        
+        if login_response.status_code != 200:
+            print(f"❌ Failed to get login page: {login_response.status_code}")
+            return None
+        
+        print("🔐 Logging in...")
+        form_fields = cache_login_form(login_response.text)
+        login_result = await client.post(LOGIN_URL, data=login_payload(form_fields, student_id, password))
+    
+    if login_result.status_code != 200:
+        print(f"❌ Login failed: {login_result.status_code}")
+        return None
+    
+    if is_dashboard(login_result.text):
+        print("✅ Already on dashboard")
+        return login_result.text
+    
+    print("🎯 Navigating to e-Governance...")
+    egovernance_data = egovernance_payload(login_result.text)
+    
+    if not egovernance_data:
+        print("❌ No e-governance link found")
+        return None
+    
+    dashboard_response = await client.post(login_result.url, data=egovernance_data)
+    
+    if dashboard_response.status_code == 200:
+        print("✅ Dashboard loaded")
+        return dashboard_response.text
+    
+    print(f"❌ Failed to load dashboard: {dashboard_response.status_code}")
+    return None
+
+
+def get_attendance_page(session: httpx.Client, dashboard_html: str) -> Optional[str]:
     """Click on attendance section to get attendance data"""
     
     print("🎯 Getting detailed attendance data...")
     
-    # Parse dashboard and get form data
-    soup = BeautifulSoup(dashboard_html, "html.parser")
-    viewstate = soup.find("input", {"name": "__VIEWSTATE"})
-    viewstate_gen = soup.find("input", {"name": "__VIEWSTATEGENERATOR"})
-    event_validation = soup.find("input", {"name": "__EVENTVALIDATION"})
-    
     # Make postback request to get attendance data
-    postback_payload = {
-        "__VIEWSTATE": viewstate['value'] if viewstate else "",
-        "__VIEWSTATEGENERATOR": viewstate_gen['value'] if viewstate_gen else "",
-        "__EVENTVALIDATION": event_validation['value'] if event_validation else "",
-        "__EVENTTARGET": "grdGrossAtt$ctl01$lnkRequestViewTT",
-        "__EVENTARGUMENT": "",
-    }
-    
     print("📡 Making postback request...")
-    response = session.post("https://charusat.edu.in:912/eGovernance/frmAppSelection.aspx", 
-                           data=postback_payload, timeout=30)
+    response = session.post(APP_SELECTION_URL, data=attendance_postback_payload(dashboard_html), timeout=30)
     
     if response.status_code == 200:
         print("✅ Detailed attendance data retrieved")
@@ -247,118 +725,133 @@ def get_attendance_page(session: requests.Session, dashboard_html: str) -> Optio
         return None
 
 
-def extract_attendance_tables(html_content: str) -> Tuple[List[Dict], Optional[str]]:
+async def get_attendance_page_async(client: httpx.AsyncClient, dashboard_html: str) -> Optional[str]:
+    """Async version of get_attendance_page using an httpx.AsyncClient"""
+    
+    print("🎯 Getting detailed attendance data...")
+    print("📡 Making postback request...")
+    response = await client.post(APP_SELECTION_URL, data=attendance_postback_payload(dashboard_html))
+    
+    if response.status_code == 200:
+        print("✅ Detailed attendance data retrieved")
+        return response.text
+    
+    print(f"❌ Failed to get detailed attendance data: {response.status_code}")
+    return None
+
+
+def extract_attendance_tables(html_content: str) -> Tuple[List[Dict], Optional[float]]:
     """Extract attendance data from HTML tables and gross attendance"""
     
-    soup = BeautifulSoup(html_content, "html.parser")
+    tree = lxml.html.fromstring(html_content)
     
     # Extract gross attendance from lblPopGrossAtt
-    gross_attendance_element = soup.find(id="lblPopGrossAtt")
     gross_attendance = None
-    if gross_attendance_element:
-        gross_text = gross_attendance_element.get_text().strip()
+    gross_elements = tree.xpath('//*[@id="lblPopGrossAtt"]')
+    if gross_elements:
+        gross_text = gross_elements[0].text_content().strip()
         print(f"🔍 Raw gross attendance text: '{gross_text}'")
         
-        # Try different patterns to extract percentage
-        # Pattern 1: Look for percentage with % sign
-        gross_match = re.search(r'(\d+(?:\.\d+)?)\s*%', gross_text)
-        if not gross_match:
-            # Pattern 2: Look for standalone number (might be without %)
-            gross_match = re.search(r'(\d+(?:\.\d+)?)', gross_text)
-        
-        if gross_match:
-            gross_attendance = float(gross_match.group(1))
+        gross_attendance = parse_gross_attendance(gross_text)
+        if gross_attendance is not None:
             print(f"📊 Gross Attendance: {gross_attendance}%")
         else:
             print(f"⚠️ Could not parse gross attendance from: '{gross_text}'")
     
-    # Extract detailed attendance tables
-    tables = soup.find_all("table")
+    # Extract detailed attendance tables; rows and cells are walked by lxml in C
     attendance_data = []
+    seen_attendance_grid = False
+    seen_course_name_grid = False
     
-    for table in tables:
-        rows = table.find_all("tr")
+    for table in tree.iter("table"):
+        rows = list(table.iter("tr"))
         if len(rows) < 2:
             continue
         
         # Check if this looks like an attendance table
-        header_row = rows[0]
-        header_text = ' '.join([th.get_text().strip().lower() for th in header_row.find_all(['th', 'td'])])
+        headers = [cell.text_content().strip() for cell in rows[0].iter("th", "td")]
+        headers = [HEADER_ALIASES.get(header, header) for header in headers]
+        header_text = ' '.join(headers).lower()
         
-        if any(word in header_text for word in ['course', 'subject', 'attendance', 'present', 'percentage']):
-            # Get headers
-            headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
-            
+        if any(word in header_text for word in ATTENDANCE_HEADER_WORDS):
             # Extract data rows
+            rows_before = len(attendance_data)
             for row in rows[1:]:
-                cells = [td.get_text().strip() for td in row.find_all(['td', 'th'])]
+                cells = [cell.text_content().strip() for cell in row.iter("td", "th")]
                 if cells and any(cell for cell in cells):
                     row_data = dict(zip(headers, cells))
                     attendance_data.append(row_data)
+            
+            # Stop once both grids have produced rows instead of walking the rest of the page
+            if len(attendance_data) > rows_before:
+                seen_attendance_grid = seen_attendance_grid or ATTENDANCE_GRID_COLUMNS.issubset(headers)
+                seen_course_name_grid = seen_course_name_grid or COURSE_NAME_GRID_COLUMNS.issubset(headers)
+                if seen_attendance_grid and seen_course_name_grid:
+                    break
     
     return attendance_data, gross_attendance
 
 
-def clean_attendance_data(raw_data: List[Dict]) -> List[Dict]:
+def clean_attendance_data(raw_data: List[Dict]) -> List[AttendanceRecord]:
     """Clean and format the attendance data"""
     
     cleaned_data = []
     course_names = {}
     
-    # First pass: collect course names
+    # Single pass: collect course names and clean attendance records together;
+    # names are attached afterwards since the name grid may come later
     for record in raw_data:
-        if 'Course Code' in record and 'Course Name' in record:
-            code = record['Course Code'].strip()
-            name = record['Course Name'].strip()
-            course_names[code] = name
-    
-    # Second pass: clean attendance records
-    for record in raw_data:
-        if all(key in record for key in ['Course', 'Class Type', 'Percentage']):
-            
-            # Clean the data
-            course = record['Course'].strip()
-            class_type = record['Class Type'].strip()
-            percentage = record['Percentage'].strip()
-            
-            # Clean the Present/Total field
-            present_total = record.get('Present / Total', record.get('Present/Total', '')).strip()
-            present_total = re.sub(r'\s+', ' ', present_total)
-            present_total = present_total.replace('/\n', '/').replace('\n/', '/')
-            
-            # Extract present and total numbers
-            present_match = re.search(r'(\d+)\s*/\s*(\d+)', present_total)
-            if present_match:
-                present = int(present_match.group(1))
-                total = int(present_match.group(2))
-            else:
-                present = None
-                total = None
-            
-            # Extract percentage number
-            percentage_match = re.search(r'(\d+(?:\.\d+)?)%', percentage)
-            percentage_num = float(percentage_match.group(1)) if percentage_match else None
-            
-            cleaned_record = {
-                'course_code': course,
-                'class_type': class_type,
-                'present': present,
-                'total': total,
-                'percentage': percentage_num,
-                'raw_present_total': present_total,
-                'raw_percentage': percentage
-            }
-            
-            # Add course name if available
-            if course in course_names:
-                cleaned_record['course_name'] = course_names[course]
-            
-            cleaned_data.append(cleaned_record)
+        code = record.get('Course Code')
+        name = record.get('Course Name')
+        if code is not None and name is not None:
+            course_names[code.strip()] = name.strip()
+        
+        course = record.get('Course')
+        class_type = record.get('Class Type')
+        percentage = record.get('Percentage')
+        if course is None or class_type is None or percentage is None:
+            continue
+        
+        # Clean the data
+        course = course.strip()
+        class_type = class_type.strip()
+        percentage = percentage.strip()
+        
+        # Clean the Present/Total field
+        present_total = record.get('Present / Total', '').strip()
+        present_total = _WS_RE.sub(' ', present_total)
+        
+        # Extract present and total numbers
+        present_match = _PRESENT_TOTAL_RE.search(present_total)
+        if present_match:
+            present = int(present_match.group(1))
+            total = int(present_match.group(2))
+        else:
+            present = None
+            total = None
+        
+        # Extract percentage number
+        percentage_match = _PCT_RE.search(percentage)
+        percentage_num = float(percentage_match.group(1)) if percentage_match else None
+        
+        cleaned_data.append(AttendanceRecord(
+            course_code=course,
+            class_type=class_type,
+            present=present,
+            total=total,
+            percentage=percentage_num,
+            raw_present_total=present_total,
+            raw_percentage=percentage
+        ))
+    
+    if course_names:
+        for record in cleaned_data:
+            record.course_name = course_names.get(record.course_code)
     
     return cleaned_data
 
 
-def generate_summary(cleaned_data: List[Dict], gross_attendance: Optional[float] = None) -> Dict:
+def generate_summary(cleaned_data: List[AttendanceRecord], gross_attendance: Optional[float] = None) -> Dict:
     """Generate summary statistics"""
     
     summary = {}
@@ -371,49 +864,35 @@ def generate_summary(cleaned_data: List[Dict], gross_attendance: Optional[float]
     if not cleaned_data:
         return summary
     
-    total_present = sum(record['present'] or 0 for record in cleaned_data)
-    total_classes = sum(record['total'] or 0 for record in cleaned_data)
-    calculated_percentage = (total_present / total_classes * 100) if total_classes > 0 else 0
-    
-    # Group by subject, keeping lecture and lab separate, avoiding duplicates
+    # Single pass: accumulate totals and keep only the first record of each
+    # subject/class-type pair, so lecture and lab stay separate and repeated
+    # rows are ignored
+    total_present = 0
+    total_classes = 0
     subjects = {}
-    seen_combinations = set()
     
     for record in cleaned_data:
-        course = record['course_code']
-        class_type = record['class_type']
-        present = record['present'] or 0
-        total = record['total'] or 0
-        
-        # Create unique identifier for this specific record
-        record_id = f"{course}_{class_type}_{present}_{total}"
+        present = record.present or 0
+        total = record.total or 0
+        total_present += present
+        total_classes += total
         
-        # Skip if we've already seen this exact record
-        if record_id in seen_combinations:
+        subject_key = (record.course_code, record.class_type)
+        if subject_key in subjects:
             continue
-        seen_combinations.add(record_id)
-        
-        # Create unique key for each subject-classtype combination
-        subject_key = f"{course}_{class_type}"
-        display_name = f"{record.get('course_name', course)} ({class_type})"
-        
-        # Use only the first occurrence of each subject-type combination
-        if subject_key not in subjects:
-            subjects[subject_key] = {
-                'course_name': display_name,
-                'course_code': course,
-                'class_type': class_type,
-                'total_present': present,
-                'total_classes': total,
-                'classes': [record]
-            }
-    
-    # Calculate subject percentages for each lecture/lab separately
-    for subject in subjects.values():
-        if subject['total_classes'] > 0:
-            subject['percentage'] = subject['total_present'] / subject['total_classes'] * 100
-        else:
-            subject['percentage'] = 0
+        
+        course, class_type = subject_key
+        subjects[subject_key] = {
+            'course_name': f"{record.course_name or course} ({class_type})",
+            'course_code': course,
+            'class_type': class_type,
+            'total_present': present,
+            'total_classes': total,
+            'classes': [msgspec.to_builtins(record)],
+            'percentage': present / total * 100 if total > 0 else 0
+        }
+    
+    calculated_percentage = (total_present / total_classes * 100) if total_classes > 0 else 0
     
     # Update summary with detailed data
     summary.update({
@@ -421,7 +900,7 @@ def generate_summary(cleaned_data: List[Dict], gross_attendance: Optional[float]
         'total_classes': total_classes,
         'calculated_percentage': round(calculated_percentage, 2),
         'total_records': len(cleaned_data),
-        'subjects': subjects
+        'subjects': {f"{course}_{class_type}": subject for (course, class_type), subject in subjects.items()}
     })
     
     # Use gross attendance as overall if available, otherwise use calculated
@@ -433,15 +912,23 @@ def generate_summary(cleaned_data: List[Dict], gross_attendance: Optional[float]
     return summary
 
 
-def save_attendance_data(data: List[Dict], filename: str = "attendance_data.json") -> bool:
-    """Save attendance data to JSON file"""
+def save_attendance_data(data: List[Dict], filename: str = "attendance_data.json", pretty: bool = False) -> Optional[str]:
+    """Save attendance data to a JSON file and return the path written"""
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        return True
+        if pretty:
+            with open(filename, 'wb') as f:
+                f.write(msgspec.json.format(msgspec.json.encode(data), indent=2))
+            return filename
+        
+        # Compact JSON through fast gzip; read back with gzip.open + msgspec.json.decode
+        if not filename.endswith('.gz'):
+            filename += '.gz'
+        with gzip.open(filename, 'wb', compresslevel=1) as f:
+            f.write(msgspec.json.encode(data))
+        return filename
     except Exception as e:
         print(f"❌ Error saving data: {e}")
-        return False
+        return None
 
 
 def print_attendance_summary(result: Dict) -> None:
@@ -487,6 +974,7 @@ def main():
     parser.add_argument("student_id", help="Student ID (e.g., 23CS012)")
     parser.add_argument("password", help="Student password")
     parser.add_argument("--save", "-s", help="Save data to JSON file", metavar="FILENAME")
+    parser.add_argument("--pretty", action="store_true", help="Save indented, uncompressed JSON")
     parser.add_argument("--quiet", "-q", action="store_true", help="Suppress output")
     
     args = parser.parse_args()
@@ -499,8 +987,9 @@ def main():
     
     # Save data if requested
     if args.save and result['success']:
-        if save_attendance_data(result['data'], args.save):
-            print(f"💾 Data saved to {args.save}")
+        saved_path = save_attendance_data(result['data'], args.save, pretty=args.pretty)
+        if saved_path:
+            print(f"💾 Data saved to {saved_path}")
     
     return result
 
@@ -509,5 +998,6 @@ if __name__ == "__main__":
     # Example usage:
     # python get_attendance.py 23CS012 011105
     # python get_attendance.py 23CS012 011105 --save my_attendance.json
+    # python get_attendance.py 23CS012 011105 --save my_attendance.json --pretty
     
     result = main()
@@ -3,12 +3,32 @@
 import asyncio
 import websockets
 import os
-import json
-from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
+from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, TextIteratorStreamer
+from transformers.pytorch_utils import Conv1D
 import torch
 import threading
 from queue import Queue
 
+# bitsandbytes is optional; with it, GPU weights are loaded as int8
+try:
+    import bitsandbytes  # noqa: F401
+    BNB_AVAILABLE = True
+except ImportError:
+    BNB_AVAILABLE = False
+
+def conv1d_to_linear(model):
+    """Swap GPT-2 style Conv1D layers for equivalent nn.Linear layers so dynamic quantization reaches them"""
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                # Conv1D stores its weight as (in_features, out_features), the transpose of Linear's
+                in_features, out_features = child.weight.shape
+                linear = torch.nn.Linear(in_features, out_features)
+                linear.weight = torch.nn.Parameter(child.weight.detach().t().contiguous())
+                linear.bias = child.bias
+                setattr(module, name, linear)
+    return model
+
 class LocalLLMBackend:
     def __init__(self, model_name="distilgpt2"):  # Using lightweight distilgpt2 for testing
         self.model_name = model_name
@@ -26,13 +46,31 @@ class LocalLLMBackend:
         try:
             # Use text generation pipeline for simplicity
             print("Initializing text generation pipeline...")
-            self.generator = pipeline(
-                "text-generation",
-                model=self.model_name,
-                device=0 if self.device == "cuda" else -1,
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                max_length=512,  # Limit max length for faster inference
-            )
+            if self.device == "cuda" and BNB_AVAILABLE:
+                # int8 weights: half the memory traffic of fp16 per generated token
+                print("Loading weights in 8-bit with bitsandbytes...")
+                self.generator = pipeline(
+                    "text-generation",
+                    model=self.model_name,
+                    device_map="auto",
+                    model_kwargs={"quantization_config": BitsAndBytesConfig(load_in_8bit=True)},
+                    max_length=512,
+                )
+            else:
+                self.generator = pipeline(
+                    "text-generation",
+                    model=self.model_name,
+                    device=0 if self.device == "cuda" else -1,
+                    torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
+                    max_length=512,  # Limit max length for faster inference
+                )
+                
+                if self.device == "cpu":
+                    # Dynamic int8 quantization for CPU inference; GPT-2 models keep their
+                    # attention and MLP weights in Conv1D, so convert those to Linear first
+                    torch.ao.quantization.quantize_dynamic(
+                        conv1d_to_linear(self.generator.model), {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+                    )
             
             print(f"✅ Model '{self.model_name}' loaded successfully!")
             
@@ -48,43 +86,64 @@ class LocalLLMBackend:
                 print(f"❌ Fallback also failed: {fallback_error}")
                 self.generator = None
     
-    async def generate_response(self, message, max_new_tokens=50):
-        """Generate response using the loaded model"""
+    async def stream_response(self, message, max_new_tokens=50):
+        """Yield the response as the model generates it"""
+        if not self.generator:
+            yield "❌ Model not available. Please restart the server."
+            return
+        
+        # Create a simple prompt for text generation
+        prompt = f"User: {message}\nAssistant:"
+        tokenizer = self.generator.tokenizer
+        model = self.generator.model
+        
+        # generate() runs on its own thread and feeds decoded text into the streamer;
+        # the timeout keeps a failed generation from blocking the reader forever
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=60)
+        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+        generation_kwargs = dict(
+            **inputs,
+            streamer=streamer,
+            max_new_tokens=max_new_tokens,
+            temperature=0.7,
+            do_sample=True,
+            pad_token_id=tokenizer.eos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            repetition_penalty=1.1,
+        )
+        threading.Thread(target=model.generate, kwargs=generation_kwargs, daemon=True).start()
+        
+        # Same cleanup as before, applied incrementally: skip leading whitespace,
+        # stop at the next "User:" or the end of the first line. Text that could
+        # still turn into the stop marker or trailing whitespace is held back.
+        text = ""
+        sent = 0
+        chunks = iter(streamer)
         try:
-            if not self.generator:
-                return "❌ Model not available. Please restart the server."
-            
-            # Create a simple prompt for text generation
-            prompt = f"User: {message}\nAssistant:"
-            
-            # Generate response
-            result = self.generator(
-                prompt,
-                max_new_tokens=max_new_tokens,
-                num_return_sequences=1,
-                temperature=0.7,
-                do_sample=True,
-                pad_token_id=self.generator.tokenizer.eos_token_id,
-                eos_token_id=self.generator.tokenizer.eos_token_id,
-                repetition_penalty=1.1,
-            )
-            
-            response = result[0]['generated_text']
-            
-            # Extract only the assistant's response
-            if "Assistant:" in response:
-                response = response.split("Assistant:")[-1].strip()
-            else:
-                response = response[len(prompt):].strip()
-            
-            # Clean up the response
-            response = response.split("User:")[0].strip()  # Stop at next user message
-            response = response.split("\n")[0].strip()     # Take first line only
-            
-            return response if response else "I'm thinking..."
+            while True:
+                piece = await asyncio.to_thread(next, chunks, None)
+                if piece is None:
+                    break
+                text = (text + piece).lstrip()
                 
+                cuts = [i for i in (text.find("User:"), text.find("\n")) if i != -1]
+                if cuts:
+                    text = text[:min(cuts)].rstrip()
+                    break
+                
+                ready = min(len(text.rstrip()), len(text) - len("User:") + 1)
+                if ready > sent:
+                    yield text[sent:ready]
+                    sent = ready
+            
+            text = text.rstrip()
+            if len(text) > sent:
+                yield text[sent:]
+            elif not text:
+                yield "I'm thinking..."
+        
         except Exception as e:
-            return f"❌ Error generating response: {str(e)}"
+            yield f"❌ Error generating response: {str(e)}"
 
 # Global model instance
 llm_backend = LocalLLMBackend()
@@ -94,17 +153,9 @@ async def handle_chat(websocket):
         async for message in websocket:
             print(f"Received message: {message}", flush=True)
             
-            # Generate response
-            response = await llm_backend.generate_response(message)
-            
-            # Send response in chunks to simulate streaming
-            words = response.split()
-            for i, word in enumerate(words):
-                if i == 0:
-                    await websocket.send(word)
-                else:
-                    await websocket.send(" " + word)
-                await asyncio.sleep(0.05)  # Small delay for streaming effect
+            # Stream the response as it is generated
+            async for chunk in llm_backend.stream_response(message):
+                await websocket.send(chunk)
             
             # Send end marker
             await websocket.send("[END]")
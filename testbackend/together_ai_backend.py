@@ -3,52 +3,114 @@
 import asyncio
 import websockets
 import os
-import json
+import re
 import sys
-from typing import AsyncGenerator, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncGenerator, Dict, Any, Optional, Tuple
 from pathlib import Path
 
+# uvloop is optional; with it, the websocket server runs on libuv
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
 # LangChain imports
-from langchain.tools import StructuredTool
-from langchain.prompts import ChatPromptTemplate
 from langchain_together import ChatTogether
 
 # LangGraph imports
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 from typing_extensions import Annotated, TypedDict
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage
+from langchain_core.tools import InjectedToolArg, StructuredTool
 
 # Import the attendance function
-from get_attendance import get_student_attendance
+from get_attendance import ATTENDANCE_CACHE_TTL, get_student_attendance
 
 # Import authentication
 from auth import AuthManager
 
 # Load environment variables from .env file if it exists
+def unquote_env_value(value: str) -> str:
+    """Strip whitespace and one pair of matching quotes, as in KEY="value" """
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+        return value[1:-1]
+    return value
+
 def load_env():
     env_file = Path(__file__).parent / '.env'
     if env_file.exists():
-        with open(env_file) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    key, value = line.split('=', 1)
-                    os.environ[key.strip()] = value.strip()
+        # Parse the whole file first; lines without "=" are skipped instead of crashing startup
+        pairs = (line.strip().partition('=') for line in env_file.read_text().splitlines())
+        for key, sep, value in pairs:
+            if sep and key and not key.startswith('#'):
+                # Variables already set in the real environment win, as with python-dotenv
+                os.environ.setdefault(key.strip(), unquote_env_value(value))
 
 load_env()
 
-def attendance_tool_func(session_id: str = None) -> str:
+# One AuthManager (and its SQLite connections) for every tool call
+auth_manager = AuthManager()
+
+# Portal scrapes block for seconds; they get their own threads so they cannot
+# starve the default executor, and at most this many run at once
+ATTENDANCE_TOOL_WORKERS = int(os.environ.get('ATTENDANCE_TOOL_WORKERS', 16))
+_attendance_pool = ThreadPoolExecutor(max_workers=ATTENDANCE_TOOL_WORKERS, thread_name_prefix="attendance")
+
+# Answers to context-free, tool-free questions are reused for identical messages
+RESPONSE_CACHE_MAXSIZE = 512
+
+# Messages mentioning these are about the student's own data and are never cached
+PERSONAL_QUERY_WORDS = ('attendance', 'my ')
+
+# Conversation history kept for follow-ups; older turns are dropped whole
+HISTORY_MAX_MESSAGES = 20
+
+# Punctuation is ignored when matching cached questions ("Who teaches ML?" == "who teaches ml")
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+
+# Streamed chunks are coalesced into frames of about this many characters...
+SEND_BUFFER_SIZE = 1024
+# ...or sent once the oldest buffered chunk has waited this long (seconds)
+SEND_FLUSH_INTERVAL = 0.02
+
+# Messages that are nothing but a greeting are answered without the agent
+_GREETING_RE = re.compile(r'^\s*(hello|hi|hey|good\s+(morning|afternoon|evening))[\s!.?,]*$', re.I)
+
+# Bare attendance requests ("show my attendance") go straight to the tool
+_ATTENDANCE_REQUEST_RE = re.compile(
+    r"^(?:(?:show|get|check|what(?:'s| is))\s+)?(?:me\s+)?(?:my\s+)?attendance\s*[?.!]*$", re.I
+)
+
+# Follow-ups answered from the attendance report already in the conversation
+_OVERALL_FOLLOWUP_RE = re.compile(
+    r"^(?:what(?:'s| is)\s+)?(?:my\s+)?overall(?:\s+attendance)?\s*[?.!]*$", re.I
+)
+_LOWEST_FOLLOWUP_RE = re.compile(
+    r"^which\s+subject(?:\s+(?:is|has))?\s+(?:the\s+)?lowest(?:\s+attendance)?\s*[?.!]*$", re.I
+)
+_BELOW_75_FOLLOWUP_RE = re.compile(
+    r"^which\s+subjects?(?:\s+(?:are|is))?\s+below\s+75\s*(?:%|percent)?\s*[?.!]*$", re.I
+)
+
+# Lines of the report written by attendance_tool_func
+_SUBJECT_LINE_RE = re.compile(r"^(?:✅|⚠️) (.+): ([\d.]+)% \((\d+)/(\d+)\)$", re.M)
+_OVERALL_LINE_RE = re.compile(r"^🎯 Overall Attendance: (.+)%$", re.M)
+
+def attendance_tool_func(refresh: bool = False, session_id: Annotated[Optional[str], InjectedToolArg] = None) -> str:
     """
     Tool function to get student attendance data using session-based authentication.
+    refresh=True bypasses the attendance cache and scrapes the portal again.
     """
     try:
         if not session_id:
             return "❌ You need to be logged in to check attendance. Please log in first."
         
-        # Get auth manager instance
-        auth_manager = AuthManager()
-        user = auth_manager.get_user_by_session(session_id)
+        # Logouts happen in the auth API process, so skip this process's session cache
+        user = auth_manager.get_user_by_session(session_id, use_cache=False)
         
         if not user:
             return "❌ Invalid session. Please log in again."
@@ -59,50 +121,157 @@ def attendance_tool_func(session_id: str = None) -> str:
         if not student_id or not password:
             return "❌ Missing credentials in your profile"
         
-        result = get_student_attendance(student_id, password)
+        result = get_student_attendance(student_id, password, force_refresh=refresh)
         if result.get('success'):
-            summary = result.get('summary', {})
+            summary = result.get('summary') or {}
             overall_percentage = summary.get('overall_percentage', 0)
-            response = f"✅ {result.get('message', '')}\n\n"
-            subjects = summary.get('subjects', {})
+            subjects = summary.get('subjects') or {}
+            # Collect the pieces and join once; low subjects are counted in the same pass
+            parts = [f"✅ {result.get('message', '')}\n\n"]
             if subjects:
-                response += "📚 Subject-wise Attendance:\n"
+                parts.append("📚 Subject-wise Attendance:\n")
+                low_count = 0
                 for subject_key, subject_info in subjects.items():
                     name = subject_info.get('course_name', subject_key)
                     percentage = subject_info.get('percentage', 0)
                     present = subject_info.get('total_present', 0)
                     total = subject_info.get('total_classes', 0)
-                    status = "⚠️" if percentage < 75 else "✅"
-                    response += f"{status} {name}: {percentage:.1f}% ({present}/{total})\n"
-                response += f"\n🎯 Overall Attendance: {overall_percentage}%"
-                low_subjects = [s for s in subjects.values() if s.get('percentage', 0) < 75]
-                if low_subjects:
-                    response += f"\n\n⚠️ Warning: {len(low_subjects)} subject(s) below 75% attendance threshold"
+                    if percentage < 75:
+                        low_count += 1
+                        status = "⚠️"
+                    else:
+                        status = "✅"
+                    parts.append(f"{status} {name}: {percentage:.1f}% ({present}/{total})\n")
+                parts.append(f"\n🎯 Overall Attendance: {overall_percentage}%")
+                if low_count:
+                    parts.append(f"\n\n⚠️ Warning: {low_count} subject(s) below 75% attendance threshold")
             else:
-                response += f"🎯 Overall Attendance: {overall_percentage}%"
-            print("________________________________________")
-            print(response)
-            return response
+                parts.append(f"🎯 Overall Attendance: {overall_percentage}%")
+            return "".join(parts)
         else:
             return f"❌ {result.get('message', 'Failed to retrieve attendance data')}"
     except Exception as e:
         return f"❌ Error retrieving attendance: {str(e)}"
 
+async def attendance_tool_coro(refresh: bool = False, session_id: Annotated[Optional[str], InjectedToolArg] = None) -> str:
+    """Run attendance_tool_func on the attendance thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_attendance_pool, attendance_tool_func, refresh, session_id)
+
+def answer_attendance_followup(message: str, history: list) -> Optional[str]:
+    """Answer a templated follow-up from the latest attendance report in history, or None"""
+    message = message.strip()
+    if _OVERALL_FOLLOWUP_RE.match(message):
+        intent = 'overall'
+    elif _LOWEST_FOLLOWUP_RE.match(message):
+        intent = 'lowest'
+    elif _BELOW_75_FOLLOWUP_RE.match(message):
+        intent = 'below_75'
+    else:
+        return None
+    
+    report = next((
+        msg.content for msg in reversed(history)
+        if isinstance(msg, (AIMessage, ToolMessage)) and isinstance(msg.content, str)
+        and _OVERALL_LINE_RE.search(msg.content)
+    ), None)
+    if report is None:
+        return None
+    
+    if intent == 'overall':
+        return f"🎯 Your overall attendance is {_OVERALL_LINE_RE.search(report).group(1)}%."
+    
+    subjects = _SUBJECT_LINE_RE.findall(report)
+    if not subjects:
+        return None
+    if intent == 'lowest':
+        name, percentage, present, total = min(subjects, key=lambda s: float(s[1]))
+        return f"📉 Your lowest attendance is in {name}: {percentage}% ({present}/{total})."
+    low_subjects = [s for s in subjects if float(s[1]) < 75]
+    if not low_subjects:
+        return "✅ None of your subjects are below 75% attendance."
+    return "⚠️ Subjects below 75% attendance:\n" + "\n".join(
+        f"{name}: {percentage}% ({present}/{total})" for name, percentage, present, total in low_subjects
+    )
+
+def tool_call_key(tool_call: Dict[str, Any]) -> Tuple[str, str]:
+    """Identify a tool call by tool name and arguments, ignoring its id"""
+    return tool_call["name"], repr(sorted(tool_call["args"].items()))
+
+# Byte-identical on every request so the provider can reuse its prompt prefix;
+# the per-user login status is appended after it by get_system_prompt
+STATIC_SYSTEM_PROMPT = """You are a helpful, friendly, and knowledgeable AI assistant for CHARUSAT students. You are a general-purpose college chatbot: you can answer questions about college life, academics, events, procedures, and more, as well as check attendance data.
+
+IMPORTANT RULES:
+1. For general conversation or college-related questions, respond normally without using tools.
+2. For attendance requests, use the get_attendance tool ONLY if the user is logged in.
+3. If user asks for attendance and they are logged in, use the tool and present the results.
+4. If user asks for attendance but they are not logged in, tell them they need to register/login first.
+5. Use the get_attendance tool ONLY ONCE per request - it returns complete information.
+6. After using the get_attendance tool, provide a friendly interpretation of the results.
+7. For follow-up questions about previously retrieved attendance data, use the information from our conversation history. DO NOT call the tool again.
+8. Present tool results clearly and conversationally.
+
+When a user asks for attendance:
+- If they are not logged in, tell them to log in first at /login
+- If they are logged in, use the tool once and present the results
+- For follow-up questions about the same attendance data, refer to the previous tool output in our conversation
+
+For all other questions, answer as a helpful college chatbot.
+
+Be helpful, friendly, and efficient."""
+
+# What the model is told about get_attendance
+ATTENDANCE_TOOL_DESCRIPTION = f"""Get student attendance data from CHARUSAT portal using stored credentials.
+            ONLY use this tool when the user asks for their attendance and they are logged in.
+            This tool automatically uses the logged-in user's credentials.
+            Results may be up to {ATTENDANCE_CACHE_TTL // 60} minutes old; set refresh to true ONLY when the user
+            explicitly asks for refreshed, latest or up-to-date attendance."""
+
+# Canned reply for messages that are only a greeting
+GREETING_RESPONSE = "Hello! I'm your CHARUSAT assistant. I can help you with general questions or check your attendance data. How can I assist you today?"
+
 # Define the state for our graph
 class AgentState(TypedDict):
     messages: Annotated[list, add_messages]
     tool_call_count: int
+    # The connection's login session and earlier turns, read-only inside the graph
+    session_id: Optional[str]
+    history: list
+
+class ChatSession:
+    """State for one websocket connection: login session and conversation history"""
+    def __init__(self):
+        # Current user session
+        self.session_id: Optional[str] = None
+        
+        # Conversation memory to store chat history
+        self.history = []
+    
+    def add_turn(self, messages: list):
+        """Append one turn to the conversation history, dropping the oldest turns when full"""
+        self.history.extend(messages)
+        
+        # Drop the oldest whole turns to prevent context overflow; cutting at a
+        # HumanMessage keeps every ToolMessage next to the call that produced it
+        if len(self.history) > HISTORY_MAX_MESSAGES:
+            start = len(self.history) - HISTORY_MAX_MESSAGES
+            while start < len(self.history) and not isinstance(self.history[start], HumanMessage):
+                start += 1
+            del self.history[:start]
+    
+    def clear_memory(self):
+        """Clear conversation history"""
+        self.history = []
+        print("🧹 Conversation memory cleared")
 
 class TogetherAIBackend:
     def __init__(self):
         self.api_key = os.getenv('TOGETHER_API_KEY')
         self.model = os.getenv('TOGETHER_MODEL', 'meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo')
         
-        # Conversation memory to store chat history
-        self.conversation_history = []
-        
-        # Current user session
-        self.current_session_id = None
+        # (normalized message, logged in) -> final answer
+        self.response_cache: Dict[Tuple[str, bool], str] = {}
         
         if not self.api_key:
             print("❌ TOGETHER_API_KEY environment variable not set!")
@@ -118,17 +287,20 @@ class TogetherAIBackend:
             max_tokens=512
         )
         
-        # Define the attendance tool
+        # Define the attendance tool; its session_id is an InjectedToolArg, hidden
+        # from the model and filled in from the connection by run_tool_call
         self.attendance_tool = StructuredTool.from_function(
-            func=self.get_attendance_with_session,
+            func=attendance_tool_func,
+            coroutine=attendance_tool_coro,
             name="get_attendance",
-            description="""Get student attendance data from CHARUSAT portal using stored credentials.
-            ONLY use this tool when the user asks for their attendance and they are logged in.
-            This tool automatically uses the logged-in user's credentials."""
+            description=ATTENDANCE_TOOL_DESCRIPTION
         )
         
+        # Tools by name, for dispatching the model's tool calls
+        self.tools = {tool.name: tool for tool in (self.attendance_tool,)}
+        
         # Bind tools to LLM
-        self.llm_with_tools = self.llm.bind_tools([self.attendance_tool])
+        self.llm_with_tools = self.llm.bind_tools(list(self.tools.values()))
         
         # Create the workflow graph
         self.workflow = StateGraph(AgentState)
@@ -152,44 +324,62 @@ class TogetherAIBackend:
         # Compile the graph
         self.app = self.workflow.compile()
         
+        # The system prompt only varies with login state, so build both messages once
+        self.system_messages = {
+            logged_in: SystemMessage(content=self.get_system_prompt(logged_in))
+            for logged_in in (True, False)
+        }
+        
         print(f"✅ Together.AI with LangGraph initialized with model: {self.model}")
     
-    def call_model(self, state: AgentState):
+    async def call_model(self, state: AgentState):
         """Call the LLM with system prompt"""
         messages = state['messages']
+        logged_in = bool(state.get('session_id'))
         
-        # Create a proper conversation with system message and history
-        conversation = []
-        
-        # Add system message
-        system_msg = f"System: {self.get_system_prompt()}"
-        conversation.append(HumanMessage(content=system_msg))
+        # System message, then conversation history, then current messages
+        conversation = [
+            self.system_messages[logged_in],
+            *state.get('history', []),
+            *messages,
+        ]
         
-        # Add conversation history (previous messages)
-        for hist_msg in self.conversation_history:
-            conversation.append(hist_msg)
+        # Logged-out users can't use the attendance tool, so leave its schema out of
+        # the request; the prompt already tells the model to ask them to log in
+        llm = self.llm_with_tools if logged_in else self.llm
         
-        # Add current messages
-        for msg in messages:
-            conversation.append(msg)
-        
-        response = self.llm_with_tools.invoke(conversation)
+        # Async so astream_events can forward the model's tokens as they arrive
+        response = await llm.ainvoke(conversation)
         return {"messages": [response]}
     
-    def call_tools(self, state: AgentState):
-        """Execute tool calls"""
+    async def run_tool_call(self, tool_call: Dict[str, Any], session_id: Optional[str]) -> str:
+        """Run one tool call for the given session; sync tools run in a worker thread via ainvoke"""
+        tool = self.tools.get(tool_call["name"])
+        if not tool:
+            return f"❌ Unknown tool: {tool_call['name']}"
+        return await tool.ainvoke({**tool_call["args"], "session_id": session_id})
+    
+    async def call_tools(self, state: AgentState):
+        """Execute tool calls concurrently"""
         messages = state['messages']
         last_message = messages[-1]
         
-        tool_outputs = []
+        # Repeated calls (same tool, same args) run once and share the output,
+        # so asking for attendance twice in one turn scrapes the portal once
+        unique_calls = {}
         for tool_call in last_message.tool_calls:
-            tool_output = self.attendance_tool.invoke(tool_call["args"])
-            tool_outputs.append(
-                ToolMessage(
-                    content=tool_output,
-                    tool_call_id=tool_call["id"]
-                )
+            unique_calls.setdefault(tool_call_key(tool_call), tool_call)
+        outputs = dict(zip(unique_calls, await asyncio.gather(
+            *(self.run_tool_call(tool_call, state.get('session_id')) for tool_call in unique_calls.values())
+        )))
+        
+        tool_outputs = [
+            ToolMessage(
+                content=outputs[tool_call_key(tool_call)],
+                tool_call_id=tool_call["id"]
             )
+            for tool_call in last_message.tool_calls
+        ]
         
         return {"messages": tool_outputs, "tool_call_count": state.get('tool_call_count', 0) + 1}
     
@@ -209,79 +399,98 @@ class TogetherAIBackend:
         # Otherwise, we're done
         return "end"
     
-    def get_system_prompt(self):
-        """Get the system prompt"""
-        session_status = "logged in" if self.current_session_id else "not logged in"
-        return f"""You are a helpful, friendly, and knowledgeable AI assistant for CHARUSAT students. You are a general-purpose college chatbot: you can answer questions about college life, academics, events, procedures, and more, as well as check attendance data.
-
-CURRENT USER STATUS: The user is {session_status}.
-
-IMPORTANT RULES:
-1. For general conversation or college-related questions, respond normally without using tools.
-2. For attendance requests, use the get_attendance tool ONLY if the user is logged in.
-3. If user asks for attendance and they are logged in, use the tool and present the results.
-4. If user asks for attendance but they are not logged in, tell them they need to register/login first.
-5. Use the get_attendance tool ONLY ONCE per request - it returns complete information.
-6. After using the get_attendance tool, provide a friendly interpretation of the results.
-7. For follow-up questions about previously retrieved attendance data, use the information from our conversation history. DO NOT call the tool again.
-8. Present tool results clearly and conversationally.
-
-When a user asks for attendance:
-- If they are not logged in, tell them to log in first at /login
-- If they are logged in, use the tool once and present the results
-- For follow-up questions about the same attendance data, refer to the previous tool output in our conversation
-
-For all other questions, answer as a helpful college chatbot.
-
-Be helpful, friendly, and efficient."""
-    
-    def set_session(self, session_id: str):
-        """Set the current session ID"""
-        self.current_session_id = session_id
+    def get_system_prompt(self, logged_in: bool):
+        """Get the system prompt for the given login state"""
+        session_status = "logged in" if logged_in else "not logged in"
+        return f"{STATIC_SYSTEM_PROMPT}\n\nCURRENT USER STATUS: The user is {session_status}."
     
-    def get_attendance_with_session(self) -> str:
-        """Wrapper function to call attendance_tool_func with current session"""
-        return attendance_tool_func(self.current_session_id)
+    def response_cache_key(self, message: str, chat: ChatSession) -> Optional[Tuple[str, bool]]:
+        """Cache key for a message, or None if its answer may depend on context"""
+        # With history present the answer may refer back to earlier turns
+        if chat.history:
+            return None
+        normalized = " ".join(_PUNCTUATION_RE.sub(" ", message.lower()).split())
+        if any(word in normalized for word in PERSONAL_QUERY_WORDS):
+            return None
+        return normalized, bool(chat.session_id)
     
-    def clear_memory(self):
-        """Clear conversation history"""
-        self.conversation_history = []
-        print("🧹 Conversation memory cleared")
+    def cache_response(self, cache_key: Tuple[str, bool], output: str):
+        """Remember a final answer, dropping the oldest one when full"""
+        if len(self.response_cache) >= RESPONSE_CACHE_MAXSIZE:
+            # Dicts keep insertion order, so this drops the oldest entry
+            self.response_cache.pop(next(iter(self.response_cache)))
+        self.response_cache[cache_key] = output
     
-    async def chat_stream(self, message: str) -> AsyncGenerator[str, None]:
-        """Stream chat completion using LangGraph agent"""
+    async def chat_stream(self, message: str, chat: ChatSession) -> AsyncGenerator[str, None]:
+        """Stream chat completion using LangGraph agent for one connection's chat"""
         try:
             # Check if this is a simple greeting
-            message_lower = message.lower().strip()
-            simple_greetings = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']
-            
-            if any(greeting in message_lower for greeting in simple_greetings) and len(message.split()) <= 3:
+            if _GREETING_RE.match(message):
                 # Handle simple greetings without using the agent
-                response = f"Hello! I'm your CHARUSAT assistant. I can help you with general questions or check your attendance data. How can I assist you today?"
-                words = response.split()
-                for i, word in enumerate(words):
-                    yield word + (" " if i < len(words) - 1 else "")
-                    await asyncio.sleep(0.03)
+                yield GREETING_RESPONSE
+                return
+            
+            # A bare attendance request needs no model to pick the tool or word the answer
+            if _ATTENDANCE_REQUEST_RE.match(message.strip()):
+                output = await self.attendance_tool.ainvoke({"session_id": chat.session_id})
+                chat.add_turn([HumanMessage(content=message), AIMessage(content=output)])
+                yield output
+                return
+            
+            # Templated follow-ups ("which subject is lowest?") are read off the last report
+            followup = answer_attendance_followup(message, chat.history)
+            if followup:
+                chat.add_turn([HumanMessage(content=message), AIMessage(content=followup)])
+                yield followup
                 return
             
             # Create human message
             human_message = HumanMessage(content=message)
             
-            # Run the graph
-            result = await asyncio.get_event_loop().run_in_executor(
-                None, 
-                lambda: self.app.invoke({"messages": [human_message], "tool_call_count": 0})
-            )
+            # Identical first-turn questions skip the LLM round trip entirely
+            cache_key = self.response_cache_key(message, chat)
+            cached_output = self.response_cache.get(cache_key) if cache_key else None
+            
+            # Whether the latest model call has already sent its text to the client
+            streamed = False
+            
+            if cached_output is not None:
+                final_messages = [AIMessage(content=cached_output)]
+            else:
+                # Run the graph, forwarding model tokens as they are generated
+                final_messages = []
+                async for event in self.app.astream_events(
+                    {
+                        "messages": [human_message],
+                        "tool_call_count": 0,
+                        "session_id": chat.session_id,
+                        "history": chat.history,
+                    },
+                    version="v2",
+                ):
+                    kind = event["event"]
+                    if kind == "on_chat_model_start":
+                        streamed = False
+                    elif kind == "on_chat_model_stream":
+                        text = event["data"]["chunk"].content
+                        if text:
+                            streamed = True
+                            yield text
+                    elif kind == "on_chain_end" and not event["parent_ids"]:
+                        # The graph itself finished; its output is the final state
+                        final_messages = event["data"]["output"]["messages"]
             
             # Get the final response
-            final_messages = result["messages"]
             output = ""
+            answer_streamed = False
             
             if final_messages:
                 # Get the last AI message
                 for msg in reversed(final_messages):
                     if isinstance(msg, AIMessage) and not msg.tool_calls:
                         output = msg.content
+                        # The answer is the last model call, so its tokens went out above
+                        answer_streamed = streamed
                         break
                     elif isinstance(msg, ToolMessage):
                         # If we only have tool output, use that
@@ -292,81 +501,119 @@ Be helpful, friendly, and efficient."""
             else:
                 output = "I'm sorry, I couldn't process your request. Please try again."
             
-            # Store conversation in memory for follow-up questions
-            self.conversation_history.append(human_message)
-            
-            # Store all messages from this conversation (including tool calls/outputs)
-            for msg in final_messages:
-                if isinstance(msg, (AIMessage, ToolMessage)):
-                    self.conversation_history.append(msg)
+            # Only plain model answers are reusable; tool output is per-student
+            answered_by_model = any(isinstance(msg, AIMessage) for msg in final_messages) and not any(
+                isinstance(msg, ToolMessage) or getattr(msg, 'tool_calls', None) for msg in final_messages
+            )
+            if cache_key and cached_output is None and output and answered_by_model:
+                self.cache_response(cache_key, output)
             
-            # Keep only last 10 messages to prevent context overflow
-            if len(self.conversation_history) > 10:
-                self.conversation_history = self.conversation_history[-10:]
+            # Store conversation in memory for follow-up questions, including
+            # all messages from this conversation (tool calls/outputs too)
+            chat.add_turn([human_message] + [
+                msg for msg in final_messages if isinstance(msg, (AIMessage, ToolMessage))
+            ])
             
-            # Stream the response preserving formatting with chunks
-            # Split by lines and send meaningful chunks
-            lines = output.split('\n')
-            for i, line in enumerate(lines):
-                if line.strip():  # Only process non-empty lines
-                    # For structured data (like attendance), send line by line
-                    # For regular text, send word by word
-                    if any(symbol in line for symbol in ['✅', '⚠️', '📚', '🎯', '%', '(']):
-                        # This looks like structured attendance data - send the whole line
-                        yield line
-                        await asyncio.sleep(0.1)
-                    else:
-                        # Regular text - send word by word
-                        words = line.split()
-                        for j, word in enumerate(words):
-                            yield word + (" " if j < len(words) - 1 else "")
-                            await asyncio.sleep(0.03)
-                # Send line break after each line (except the last one)
-                if i < len(lines) - 1:
-                    yield "\n"
-                    await asyncio.sleep(0.03)
+            # Tool output, fallbacks and cached answers were not streamed token by token
+            if not answer_streamed:
+                yield output
                 
         except Exception as e:
             print(f"❌ Error in chat_stream: {e}")
             yield f"I'm sorry, I encountered an error. Please try again."
 
-# Global Together.AI instance
+# Global Together.AI instance; per-user state lives in each connection's ChatSession
 together_ai = TogetherAIBackend()
 
+async def _handle_clear(websocket, chat: ChatSession):
+    """Clear conversation memory"""
+    chat.clear_memory()
+    await websocket.send("Memory cleared successfully! How can I help you?")
+    await websocket.send("[END]")
+
+async def _handle_logout(websocket, chat: ChatSession):
+    """Clear memory and drop the session"""
+    chat.clear_memory()
+    chat.session_id = None
+    await websocket.send("You have been logged out. Memory cleared.")
+    await websocket.send("[END]")
+
+async def send_buffered(websocket, chunks: AsyncGenerator[str, None]):
+    """Send streamed chunks in fewer, larger websocket frames"""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    async def produce():
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    queue.put_nowait(chunk)
+        finally:
+            queue.put_nowait(None)
+    
+    # The stream is read by its own task, so a slow send never stalls the model;
+    # whatever arrives meanwhile goes out together in the next frame
+    producer = asyncio.create_task(produce())
+    try:
+        finished = False
+        while not finished:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            buffer = [chunk]
+            size = len(chunk)
+            deadline = loop.time() + SEND_FLUSH_INTERVAL
+            while size < SEND_BUFFER_SIZE:
+                if queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        chunk = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    chunk = queue.get_nowait()
+                if chunk is None:
+                    finished = True
+                    break
+                buffer.append(chunk)
+                size += len(chunk)
+            await websocket.send("".join(buffer))
+        # Surface any error from the stream itself
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+
+# Exact-match control messages sent by the frontend
+COMMANDS = {
+    "CLEAR_MEMORY": _handle_clear,
+    "LOGOUT": _handle_logout,
+}
+
 async def handle_chat(websocket):
     """Handle WebSocket chat messages"""
     try:
-        # Get session ID from query parameters if available
-        session_id = None
+        # Login session and history for this connection only
+        chat = ChatSession()
         
         async for message in websocket:
-            # Check if this is a session setup message
-            if message.startswith("SESSION:"):
-                session_id = message.replace("SESSION:", "")
-                together_ai.set_session(session_id)
-                continue
-            
-            # Check if this is a clear memory command
-            if message == "CLEAR_MEMORY":
-                together_ai.clear_memory()
-                await websocket.send("Memory cleared successfully! How can I help you?")
-                await websocket.send("[END]")
+            # Check if this is a clear memory or logout command
+            command = COMMANDS.get(message)
+            if command:
+                await command(websocket, chat)
                 continue
             
-            # Check if this is a logout command
-            if message == "LOGOUT":
-                together_ai.clear_memory()
-                together_ai.set_session(None)
-                await websocket.send("You have been logged out. Memory cleared.")
-                await websocket.send("[END]")
+            # Check if this is a session setup message
+            if message.startswith("SESSION:"):
+                chat.session_id = message.replace("SESSION:", "")
                 continue
             
             print(f"📨 Received: {message}", flush=True)
             
             # Stream response from Together.AI with LangChain
-            async for chunk in together_ai.chat_stream(message):
-                if chunk:  # Only send non-empty chunks
-                    await websocket.send(chunk)
+            await send_buffered(websocket, together_ai.chat_stream(message, chat))
             
             # Send end marker
             await websocket.send("[END]")
@@ -386,10 +633,13 @@ async def main():
     print(f"🤖 Using model: {together_ai.model}")
     print("🛠️  Available tools: get_attendance")
     
+    # Replies are short text frames; per-message deflate would spend CPU on each
+    # frame and keep a zlib context per connection for little bandwidth saved
     async with websockets.serve(
         handle_chat,
         "0.0.0.0",
-        port
+        port,
+        compression=None
     ) as server:
         print(f"✅ WebSocket server running on port {port}")
         print("🔗 Connect your frontend to this server")
@@ -399,7 +649,10 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if UVLOOP_AVAILABLE:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         print("\n👋 Server stopped")
     except Exception as e: